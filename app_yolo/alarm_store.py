@@ -0,0 +1,204 @@
+import json
+import queue
+import sqlite3
+import threading
+from collections import Counter
+
+OPEN_STATUSES = ('new', 'acknowledged')
+CLOSED_STATUSES = ('resolved', 'false_positive')
+
+ALARM_TRANSITIONS = {
+    'acknowledge': (('new',), 'acknowledged'),
+    'resolve': (('acknowledged',), 'resolved'),
+    'false_positive': (('new', 'acknowledged'), 'false_positive'),
+}
+
+_LATEST_STATE_SQL = """
+    SELECT alarm_id, camera_id, type, status, timestamp_detected, event_time, data FROM alarm_events
+    WHERE event_id IN (SELECT MAX(event_id) FROM alarm_events GROUP BY alarm_id)
+"""
+
+
+class AlarmStore:
+    """Alarmas abiertas en memoria, indexadas por id y con contadores por cámara, estado y tipo.
+
+    Cada cambio se añade a un log SQLite (solo inserciones) desde un hilo
+    escritor, fuera del bucle de procesamiento, que en la misma transacción
+    actualiza la tabla ``alarms`` con el último estado de cada alarma: el
+    historial consulta esa tabla por sus índices sin recorrer el log. Las
+    alarmas cerradas salen de memoria; las abiertas se recuperan al arrancar.
+    """
+
+    def __init__(self, db_path, on_change=None):
+        self.db_path = db_path
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._alarms = {}
+        self._counts = Counter()
+        self._write_queue = queue.Queue()
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS alarm_events (
+                    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    alarm_id TEXT NOT NULL,
+                    camera_id TEXT,
+                    type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    timestamp_detected TEXT NOT NULL,
+                    event_time TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_alarm_events_alarm ON alarm_events (alarm_id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS alarms (
+                    alarm_id TEXT PRIMARY KEY,
+                    camera_id TEXT,
+                    type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    timestamp_detected TEXT NOT NULL,
+                    event_time TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_alarms_detected ON alarms (timestamp_detected)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_alarms_status ON alarms (status)")
+            if conn.execute("SELECT 1 FROM alarms LIMIT 1").fetchone() is None:
+                # Bases creadas antes de existir la tabla: se rellena una vez a partir del log.
+                conn.execute(f"INSERT INTO alarms {_LATEST_STATE_SQL}")
+            placeholders = ','.join('?' * len(OPEN_STATUSES))
+            rows = conn.execute(f"SELECT data FROM alarms WHERE status IN ({placeholders})",
+                                OPEN_STATUSES).fetchall()
+        for (data,) in rows:
+            alarm = json.loads(data)
+            self._alarms[alarm['id']] = alarm
+            self._counts[(alarm.get('camera_id'), alarm['status'], alarm['type'])] += 1
+        if rows:
+            print(f"Recuperadas {len(rows)} alarmas abiertas de '{db_path}'.")
+
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True, name='alarm-store-writer')
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _writer_loop(self):
+        conn = self._connect()
+        while True:
+            events = [self._write_queue.get()]
+            while True:
+                try:
+                    events.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in events
+            rows = [(a['id'], a.get('camera_id'), a['type'], a['status'], a['timestamp_detected'],
+                     a['last_status_change'], json.dumps(a)) for a in events if a is not None]
+            try:
+                with conn:
+                    conn.executemany("""INSERT INTO alarm_events
+                        (alarm_id, camera_id, type, status, timestamp_detected, event_time, data)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+                    # En orden de llegada: el último evento de cada alarma es el que queda.
+                    conn.executemany("""INSERT OR REPLACE INTO alarms
+                        (alarm_id, camera_id, type, status, timestamp_detected, event_time, data)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+            except sqlite3.Error as e:
+                print(f"Error al guardar alarmas en '{self.db_path}': {e}")
+            if stop:
+                break
+        conn.close()
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def add(self, alarm):
+        with self._lock:
+            self._alarms[alarm['id']] = alarm
+            self._counts[(alarm.get('camera_id'), alarm['status'], alarm['type'])] += 1
+            self._write_queue.put(dict(alarm))
+        self._changed()
+
+    def update(self, alarm_id, **fields):
+        with self._lock:
+            alarm = self._alarms.get(alarm_id)
+            if alarm is None:
+                return None
+            alarm.update(fields)
+            self._write_queue.put(dict(alarm))
+            updated = dict(alarm)
+        self._changed()
+        return updated
+
+    def transition(self, alarm_id, action, timestamp_iso):
+        """Aplica ``action`` si el estado actual lo permite. Devuelve (alarma, éxito); alarma es None si no existe."""
+        with self._lock:
+            alarm = self._alarms.get(alarm_id)
+            if alarm is None:
+                return None, False
+            allowed_from, new_status = ALARM_TRANSITIONS.get(action, ((), None))
+            if alarm['status'] not in allowed_from:
+                return dict(alarm), False
+            self._counts[(alarm.get('camera_id'), alarm['status'], alarm['type'])] -= 1
+            alarm['status'] = new_status
+            alarm['last_status_change'] = timestamp_iso
+            if new_status in CLOSED_STATUSES:
+                del self._alarms[alarm_id]
+            else:
+                self._counts[(alarm.get('camera_id'), new_status, alarm['type'])] += 1
+            self._write_queue.put(dict(alarm))
+            updated = dict(alarm)
+        self._changed()
+        return updated, True
+
+    def counts_by_type(self, camera_id, status, alarm_types):
+        with self._lock:
+            return {alarm_type: self._counts[(camera_id, status, alarm_type)] for alarm_type in alarm_types}
+
+    def totals(self):
+        """Número de alarmas abiertas por (estado, tipo), sumando todas las cámaras."""
+        totals = Counter()
+        with self._lock:
+            for (_, status, alarm_type), count in self._counts.items():
+                totals[(status, alarm_type)] += count
+        return totals
+
+    def active(self):
+        with self._lock:
+            return [dict(alarm) for alarm in self._alarms.values()]
+
+    def history(self, since=None, until=None, camera_id=None, alarm_type=None, status=None, page=1, page_size=50):
+        """Último estado conocido de cada alarma (abierta o cerrada) detectada en [since, until], paginado."""
+        conditions = []
+        params = []
+        if since:
+            conditions.append("timestamp_detected >= ?")
+            params.append(since)
+        if until:
+            conditions.append("timestamp_detected <= ?")
+            params.append(until)
+        if camera_id:
+            conditions.append("camera_id = ?")
+            params.append(camera_id)
+        if alarm_type:
+            conditions.append("type = ?")
+            params.append(alarm_type)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            total = conn.execute(f"SELECT COUNT(*) FROM alarms {where}", params).fetchone()[0]
+            rows = conn.execute(f"""SELECT data FROM alarms {where}
+                                    ORDER BY timestamp_detected DESC
+                                    LIMIT ? OFFSET ?""", params + [page_size, (page - 1) * page_size]).fetchall()
+        finally:
+            conn.close()
+        return [json.loads(data) for (data,) in rows], total
+
+    def close(self):
+        self._write_queue.put(None)
+        self._writer.join(timeout=5)
@@ -1,19 +1,50 @@
 import cv2
 import cvzone
 import math
-from ultralytics import YOLO
 import time
 import threading
-from flask import Flask, render_template, Response, jsonify, request
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, render_template, Response, jsonify, request, send_file
+import os
 import uuid
 from datetime import datetime
 import numpy as np
+import json
+from alarm_store import AlarmStore
+from change_notifier import ChangeNotifier
+from clip_recorder import ClipRecorder
+from clock import SystemClock
+from frame_hub import FrameHub
+from process_inference import ProcessInferencePool
+from metrics import InstrumentedLock, MetricsRegistry, SamplingProfiler
+from model_lifecycle import MODEL_WARMING_UP, ModelLifecycle
+from motion_gate import MotionGate
+from tracker import Tracker, iou_matrix
+from zones import ZoneStore, crop_detections_to_frame, draw_zones, zone_crops, zones_mask
 
 VIDEO_PATH = 'x.mp4'
+CAMERAS = {
+    'cam1': VIDEO_PATH,
+}
 YOLO_PERSON_MODEL_PATH = 'yolov8s.pt'
 CLASSES_PERSON_FILE_PATH = 'classes.txt'
 YOLO_FIRE_MODEL_PATH = 'fire_model.pt'
 CLASSES_FIRE_FILE_PATH = 'classes_fire.txt'
+MODEL_BACKEND_PERSON = 'pytorch'
+MODEL_BACKEND_FIRE = 'pytorch'
+MODEL_INT8_PERSON = False
+MODEL_INT8_FIRE = False
+MODEL_CACHE_DIR = 'model_cache'
+MODEL_WARMUP_RUNS = 3
+CALIBRATION_VIDEO_PATH = VIDEO_PATH
+CALIBRATION_NUM_FRAMES = 100
+INFERENCE_POOL_WORKERS = 1
+INFERENCE_MAX_BATCH = 8
+INFERENCE_BATCH_WAIT_SEC = 0.01
+INFERENCE_USE_PROCESSES = False
+INFERENCE_PROCESS_WORKERS = 2
+INFERENCE_SLOTS_PER_WORKER = 4
 
 FRAME_PROCESS_WIDTH = 640
 FRAME_PROCESS_HEIGHT = 480
@@ -36,396 +67,1169 @@ LIGHT_BRIGHTNESS_THRESHOLD_OFF = 90
 HOUR_START_LIGHT_CHECK = 0
 HOUR_END_LIGHT_CHECK = 24
 
-lock = threading.Lock()
-output_frame = None
+MOTION_GATE_ENABLED = True
+MOTION_DOWNSCALE_WIDTH = 160
+MOTION_PIXEL_DIFF_THRESHOLD = 25
+MOTION_MIN_CHANGED_RATIO = 0.005
+MOTION_BACKGROUND_ALPHA = 0.05
+PERSON_MAX_SKIP_SEC = 2.0
+FIRE_MAX_SKIP_SEC = 0.5
+
+DETECT_EVERY_N_FRAMES = 5
+TRACK_MIN_CONFIDENCE = 0.3
+TRACK_IOU_THRESHOLD = 0.3
+TRACK_CENTER_GATE = 0.75
+# Un track nuevo cuya caja solapa (IoU) con la de una alarma de caída reciente se considera la misma persona.
+FALL_ALARM_SUPPRESS_IOU = 0.3
+TRACK_MAX_MISSES = 3
+TRACK_CONFIDENCE_DECAY = 0.85
+# Un track con una sola detección puede ser un falso positivo: no arranca temporizador de caída.
+TRACK_MIN_HITS = 2
+
+CAPTURE_RECONNECT_DELAY_SEC = 2.0
+CAPTURE_MAX_RECONNECT_ATTEMPTS = 5
+PIPELINE_WAIT_TIMEOUT_SEC = 1.0
+STREAM_KEEPALIVE_SEC = 5.0
+ALARMS_DB_PATH = 'alarms.db'
+ALARM_HISTORY_MAX_PAGE_SIZE = 200
+ALARM_TYPES = ('fuego_desatendido', 'caida', 'luz_olvidada')
+SSE_KEEPALIVE_SEC = 15.0
+SSE_MIN_INTERVAL_SEC = 0.25
+STREAM_TIER_WIDTHS = (160, 320, 480, 640)
+STREAM_DEFAULT_QUALITY = 80
+STREAM_MIN_QUALITY = 20
+STREAM_MAX_QUALITY = 95
+STREAM_MAX_FPS = 30
+STREAM_ENCODE_WORKERS = 2
+# Con la grabación activa cada frame procesado se codifica a JPEG para el buffer de clips, haya o no
+# clientes del stream (coste de CPU continuo). Cada cámara lo hace en su propio hilo, fuera del
+# procesamiento; si una cámara acumula más de CLIP_ENCODE_MAX_PENDING frames sin codificar, se
+# descartan para su clip (clip_frames_skipped). Los clips usan un tier más ligero que el stream.
+CLIP_RECORDING_ENABLED = True
+CLIP_ENCODE_MAX_PENDING = 8
+CLIP_FRAME_WIDTH = 480
+CLIP_JPEG_QUALITY = 70
+CLIPS_DIR = 'clips'
+CLIP_PRE_EVENT_SEC = 5.0
+CLIP_POST_EVENT_SEC = 5.0
+CLIP_BUFFER_MAX_BYTES = 32 * 1024 * 1024
+CLIP_FALLBACK_FPS = 15
+PROFILER_ENABLED_AT_START = False
+PROFILER_INTERVAL_SEC = 0.01
+FPS_EMA_ALPHA = 0.1
+# Zonas poligonales por cámara (editables desde el dashboard). Si una cámara tiene zonas de fuego, el
+# modelo de fuego solo ve recortes de esas zonas tomados del frame a resolución completa; las zonas de
+# luz limitan la medida de brillo. Sin zonas se usa el frame completo.
+ZONES_CONFIG_PATH = 'zones.json'
+ZONES_MAX_PER_CAMERA = 4
+ZONE_CROP_SIZE = 320
+
+STATUS_CLASS_SEVERITY = {
+    'status-normal': 0,
+    'status-possible-fall': 1,
+    'status-alarm-active': 2,
+    'status-alarm-critical': 3,
+}
+
+metrics = MetricsRegistry()
+frame_stage_seconds = metrics.histogram('frame_stage_seconds', 'Duración de cada etapa del procesado de un frame.',
+                                        ('camera', 'stage'))
+model_inference_seconds = metrics.histogram('model_inference_seconds', 'Duración de una llamada a un modelo (lote completo).',
+                                            ('model',))
+model_batch_size = metrics.histogram('model_batch_size', 'Frames por llamada al modelo.', ('model',),
+                                     buckets=(1, 2, 4, 8, 16))
+stream_encode_seconds = metrics.histogram('stream_encode_seconds', 'Duración de la codificación JPEG por tier.', ('tier',))
+lock_wait_seconds = metrics.histogram('lock_wait_seconds', 'Tiempo de espera para adquirir un lock.', ('lock',))
+lock_hold_seconds = metrics.histogram('lock_hold_seconds', 'Tiempo que se mantiene un lock adquirido.', ('lock',))
+alarms_created_total = metrics.counter('alarms_created_total', 'Alarmas generadas.', ('camera', 'type'))
+
+lock = InstrumentedLock(lock_wait_seconds, lock_hold_seconds, 'shared')
+profiler = SamplingProfiler(PROFILER_INTERVAL_SEC)
 general_status_text_shared = "Estado: Inicializando..."
 general_status_class_shared = "status-normal"
 stop_processing_flag = threading.Event()
 
-active_alarms_shared = []
-last_fall_alarm_time = 0
-last_unattended_fire_alarm_time = 0
-last_light_alarm_time = 0
+status_notifier = ChangeNotifier()
+# Almacén de alarmas, grabadora de clips, zonas y cámaras se crean en init_runtime(), no al importar.
+alarm_store = None
+clip_recorder = None
+zone_store = None
+status_payload_cache = {'version': -1, 'body': None}
+
+
+def mark_clip_ready(alarm_id, snapshot_path, clip_path):
+    # Si la alarma ya se cerró no está en memoria; los ficheros siguen accesibles por su id.
+    alarm_store.update(alarm_id, clip_ready=True)
 
-app = Flask(__name__)
+
+cameras = {}
+
+app = Quart(__name__)
 
 model_person = None
 classnames_person = []
 model_fire = None
 classnames_fire = []
+calibration_frames = None
+person_class_ids = []
+fire_class_ids = []
+inference_pool = None
+model_lifecycle = ModelLifecycle(('person', 'fire'))
+app_started_at = time.time()
 
-try:
-    model_person = YOLO(YOLO_PERSON_MODEL_PATH)
-    with open(CLASSES_PERSON_FILE_PATH, 'r') as f:
-        classnames_person = f.read().splitlines()
-    print(f"Modelo de detección de personas '{YOLO_PERSON_MODEL_PATH}' y clases cargados.")
-except Exception as e:
-    print(f"Error al cargar modelo de personas o clases: {e}")
-
-try:
-    model_fire = YOLO(YOLO_FIRE_MODEL_PATH)
-    with open(CLASSES_FIRE_FILE_PATH, 'r') as f:
-        classnames_fire = f.read().splitlines()
-    print(f"Modelo de detección de fuego '{YOLO_FIRE_MODEL_PATH}' y clases cargados.")
-except Exception as e:
-    print(f"Error al cargar modelo de fuego o clases: {e}")
-
-
-def create_new_alarm(alarm_type="caida"):
-    global active_alarms_shared, last_fall_alarm_time, last_unattended_fire_alarm_time, last_light_alarm_time, lock
-    current_time = time.time()
-
-    if alarm_type == "caida":
-        if current_time - last_fall_alarm_time < ALARM_COOLDOWN_SEC_FALL:
-            return None
-        last_fall_alarm_time = current_time
-    elif alarm_type == "fuego_desatendido":
-        if current_time - last_unattended_fire_alarm_time < ALARM_COOLDOWN_SEC_UNATTENDED_FIRE:
+
+def load_calibration_frames():
+    needs_int8 = (MODEL_INT8_PERSON and MODEL_BACKEND_PERSON != 'pytorch') or \
+                 (MODEL_INT8_FIRE and MODEL_BACKEND_FIRE != 'pytorch')
+    if not needs_int8:
+        return None
+    try:
+        from backends import sample_calibration_frames
+        return sample_calibration_frames(CALIBRATION_VIDEO_PATH, CALIBRATION_NUM_FRAMES,
+                                         FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT)
+    except Exception as e:
+        print(f"Error al obtener frames de calibración INT8: {e}")
+        return None
+
+
+def load_person_model(warmup_runs=MODEL_WARMUP_RUNS):
+    from backends import load_detection_model
+    return load_detection_model(YOLO_PERSON_MODEL_PATH, MODEL_BACKEND_PERSON, MODEL_INT8_PERSON,
+                                (FRAME_PROCESS_HEIGHT, FRAME_PROCESS_WIDTH), MODEL_CACHE_DIR,
+                                calibration_frames, classnames_person, warmup_runs)
+
+
+def load_fire_model(warmup_runs=MODEL_WARMUP_RUNS):
+    from backends import load_detection_model
+    return load_detection_model(YOLO_FIRE_MODEL_PATH, MODEL_BACKEND_FIRE, MODEL_INT8_FIRE,
+                                (FRAME_PROCESS_HEIGHT, FRAME_PROCESS_WIDTH), MODEL_CACHE_DIR,
+                                calibration_frames, classnames_fire, warmup_runs)
+
+
+def load_and_warm_up(name, classes_path, load_model):
+    """Lee las clases y carga el modelo; después lo calienta para que la primera inferencia real no pague ese coste."""
+    from backends import warmup_model
+    with open(classes_path, 'r') as f:
+        classnames = f.read().splitlines()
+    model = load_model(warmup_runs=0)
+    model_lifecycle.set_state(name, MODEL_WARMING_UP)
+    warmup_model(model, (FRAME_PROCESS_HEIGHT, FRAME_PROCESS_WIDTH), MODEL_WARMUP_RUNS)
+    return classnames, model
+
+
+def prepare_model_artifact(classes_path, weights_path, backend, int8):
+    """Modo procesos: lee las clases y deja en la caché el artefacto exportado, sin cargar el modelo aquí.
+
+    Cada worker carga su copia; exportar una sola vez evita que los workers
+    compitan por escribir el mismo artefacto y, con INT8, es el único sitio
+    donde hay frames de calibración.
+    """
+    with open(classes_path, 'r') as f:
+        classnames = f.read().splitlines()
+    if backend != 'pytorch':
+        from backends import export_model
+        export_model(weights_path, backend, int8, (FRAME_PROCESS_HEIGHT, FRAME_PROCESS_WIDTH), MODEL_CACHE_DIR,
+                     calibration_frames, classnames)
+    return classnames, None
+
+
+def create_detection_models():
+    worker_model_person = load_person_model() if model_person and classnames_person else None
+    worker_model_fire = load_fire_model() if model_fire and classnames_fire else None
+    return worker_model_person, worker_model_fire
+
+
+def observe_model_call(model_name, seconds, batch_size):
+    model_inference_seconds.observe(seconds, model=model_name)
+    model_batch_size.observe(batch_size, model=model_name)
+
+
+def detection_model_spec(weights_path, backend, int8, classnames):
+    # Argumentos de load_detection_model para un proceso worker. Sin frames de calibración:
+    # prepare_model_artifact ya ha dejado el artefacto (INT8 incluido) en caché.
+    return {'weights_path': weights_path, 'backend': backend, 'int8': int8,
+            'imgsz': (FRAME_PROCESS_HEIGHT, FRAME_PROCESS_WIDTH), 'cache_dir': MODEL_CACHE_DIR,
+            'calibration_frames': None, 'classnames': classnames, 'warmup_runs': MODEL_WARMUP_RUNS}
+
+
+def create_inference_pool():
+    if INFERENCE_USE_PROCESSES:
+        return ProcessInferencePool(
+            detection_model_spec(YOLO_PERSON_MODEL_PATH, MODEL_BACKEND_PERSON, MODEL_INT8_PERSON, classnames_person)
+            if classnames_person else None,
+            detection_model_spec(YOLO_FIRE_MODEL_PATH, MODEL_BACKEND_FIRE, MODEL_INT8_FIRE, classnames_fire)
+            if classnames_fire else None,
+            MIN_CONFIDENCE_PERSON, MIN_CONFIDENCE_FIRE, (FRAME_PROCESS_HEIGHT, FRAME_PROCESS_WIDTH, 3),
+            num_workers=INFERENCE_PROCESS_WORKERS, slots_per_worker=INFERENCE_SLOTS_PER_WORKER,
+            max_batch=INFERENCE_MAX_BATCH, batch_wait_sec=INFERENCE_BATCH_WAIT_SEC, on_timing=observe_model_call,
+            classes_person=person_class_ids or None, classes_fire=fire_class_ids or None,
+            crop_shape=(ZONE_CROP_SIZE, ZONE_CROP_SIZE, 3), max_crops_per_frame=ZONES_MAX_PER_CAMERA)
+    from inference import InferencePool
+    return InferencePool(create_detection_models, MIN_CONFIDENCE_PERSON, MIN_CONFIDENCE_FIRE,
+                         num_workers=INFERENCE_POOL_WORKERS, max_batch=INFERENCE_MAX_BATCH,
+                         batch_wait_sec=INFERENCE_BATCH_WAIT_SEC,
+                         initial_models=(model_person if classnames_person else None,
+                                         model_fire if classnames_fire else None),
+                         on_timing=observe_model_call,
+                         classes_person=person_class_ids or None, classes_fire=fire_class_ids or None)
+
+
+def load_models():
+    """Carga en paralelo ambos modelos con sus clases, los calienta y crea el pool de inferencia.
+
+    Bloquea hasta terminar; la aplicación lo lanza en un hilo para servir
+    HTTP desde el primer momento. Mientras el pool no esté listo, los frames
+    se procesan sin detección (el stream y la comprobación de luz siguen
+    activos). Con INFERENCE_USE_PROCESSES los modelos solo se cargan en los
+    workers: aquí únicamente se preparan los artefactos exportados.
+    """
+    global model_person, classnames_person, model_fire, classnames_fire, calibration_frames, inference_pool
+    global person_class_ids, fire_class_ids
+    calibration_frames = load_calibration_frames()
+    if INFERENCE_USE_PROCESSES:
+        loaded = model_lifecycle.load_all({
+            'person': lambda: prepare_model_artifact(CLASSES_PERSON_FILE_PATH, YOLO_PERSON_MODEL_PATH,
+                                                     MODEL_BACKEND_PERSON, MODEL_INT8_PERSON),
+            'fire': lambda: prepare_model_artifact(CLASSES_FIRE_FILE_PATH, YOLO_FIRE_MODEL_PATH,
+                                                   MODEL_BACKEND_FIRE, MODEL_INT8_FIRE),
+        })
+    else:
+        loaded = model_lifecycle.load_all({
+            'person': lambda: load_and_warm_up('person', CLASSES_PERSON_FILE_PATH, load_person_model),
+            'fire': lambda: load_and_warm_up('fire', CLASSES_FIRE_FILE_PATH, load_fire_model),
+        })
+    if loaded['person'] is not None:
+        classnames_person, model_person = loaded['person']
+        print(f"Modelo de detección de personas '{YOLO_PERSON_MODEL_PATH}' ({MODEL_BACKEND_PERSON}) y clases cargados.")
+    else:
+        print("ADVERTENCIA: Modelo de PERSONAS no cargado. Detección de caídas y presencia no funcionará.")
+    if loaded['fire'] is not None:
+        classnames_fire, model_fire = loaded['fire']
+        print(f"Modelo de detección de fuego '{YOLO_FIRE_MODEL_PATH}' ({MODEL_BACKEND_FIRE}) y clases cargados.")
+    else:
+        print("ADVERTENCIA: Modelo de FUEGO no cargado. Detección de fuego no funcionará.")
+    person_class_ids = [idx for idx, name in enumerate(classnames_person) if name == 'person']
+    fire_class_ids = [idx for idx, name in enumerate(classnames_fire) if name == 'fire']
+    if not classnames_person and not classnames_fire:
+        print("ERROR CRÍTICO: Ningún modelo pudo ser cargado. Solo se servirán el vídeo y la detección de luz.")
+        return
+    inference_pool = create_inference_pool()
+    if INFERENCE_USE_PROCESSES:
+        print(f"Artefactos preparados en {model_lifecycle.elapsed_sec():.1f}s; los workers están cargando los modelos.")
+    else:
+        print(f"Modelos listos en {model_lifecycle.elapsed_sec():.1f}s.")
+
+
+def ready_inference_pool():
+    """El pool de inferencia si ya puede atender frames (algún worker con los modelos cargados), o None."""
+    pool = inference_pool
+    return pool if pool is not None and pool.ready else None
+
+
+class CameraState:
+    def __init__(self, camera_id, video_path, clock=None):
+        self.camera_id = camera_id
+        self.video_path = video_path
+        # Toda la lógica de alarmas lee la hora de este reloj; el replay inyecta uno simulado.
+        self.clock = clock or SystemClock()
+        self.frame_hub = FrameHub(on_encode=lambda seconds, tier: stream_encode_seconds.observe(seconds, tier=tier))
+        self.status_text = "Estado: Inicializando..."
+        self.status_class = "status-normal"
+        self.last_alarm_time = {'caida': 0, 'fuego_desatendido': 0, 'luz_olvidada': 0}
+        self.recent_track_alarms = []
+        self.pipeline_stats = {
+            'frames_captured': 0,
+            'frames_processed': 0,
+            'frames_dropped_capture': 0,
+            'last_frame_latency_sec': None,
+            'last_capture_to_alarm_latency_sec': None,
+            'processed_fps': 0.0,
+            'clip_frames_skipped': 0,
+        }
+        self.last_processed_at = None
+
+        self.person_potentially_fallen_since = None
+        self.last_light_check_time = 0.0
+        self.light_is_on_state = False
+        self.light_on_no_person_start_time = None
+        self.fire_detected_continuously_since = None
+        self.last_person_seen_timestamp = self.clock.time()
+        self.potential_unattended_fire_alerted_this_cycle = False
+
+        self.motion_gate = MotionGate(MOTION_DOWNSCALE_WIDTH, MOTION_PIXEL_DIFF_THRESHOLD, MOTION_MIN_CHANGED_RATIO,
+                                      MOTION_BACKGROUND_ALPHA, PERSON_MAX_SKIP_SEC, FIRE_MAX_SKIP_SEC)
+        self.last_results_fire = None
+        self.tracker = Tracker(TRACK_IOU_THRESHOLD, TRACK_MAX_MISSES, TRACK_CONFIDENCE_DECAY,
+                               TRACK_CENTER_GATE)
+        self.frames_since_person_detection = 0
+        # Un hilo por cámara: sus frames llegan al buffer de clips en orden y una cámara no retrasa a otra.
+        self.clip_encode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'clip-encode-{camera_id}')
+        self.clip_encode_slots = threading.BoundedSemaphore(CLIP_ENCODE_MAX_PENDING)
+
+        self.zones_version = None
+        self.zones = []
+        self.fire_zones = []
+        self.light_mask = None
+
+    def refresh_zones(self):
+        # Lo derivado de las zonas solo se recalcula cuando se editan.
+        version = zone_store.version
+        if version == self.zones_version:
+            return
+        self.zones_version = version
+        self.zones = zone_store.get(self.camera_id)
+        self.fire_zones = [zone for zone in self.zones if zone['fire']]
+        self.light_mask = zones_mask([zone for zone in self.zones if zone['light']],
+                                     FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT)
+
+    def status_dict(self):
+        return {
+            'id': self.camera_id,
+            'status_text': self.status_text,
+            'status_class': self.status_class,
+        }
+
+    def stats_dict(self):
+        return {
+            'id': self.camera_id,
+            'pipeline': dict(self.pipeline_stats),
+            'motion_gate': self.motion_gate.to_dict(),
+            'tracks': len(self.tracker.tracks),
+            'zones': len(self.zones),
+            'stream': self.frame_hub.stats(),
+        }
+
+
+def init_runtime():
+    """Abre el almacén de alarmas, arranca la grabadora de clips, lee las zonas y crea las cámaras.
+
+    No se hace al importar el módulo: con INFERENCE_USE_PROCESSES los workers
+    ('spawn') importan de nuevo el script principal, y no deben abrir la base
+    de datos ni arrancar hilos.
+    """
+    global alarm_store, clip_recorder, zone_store
+    alarm_store = AlarmStore(ALARMS_DB_PATH, on_change=status_notifier.bump)
+    clip_recorder = ClipRecorder(CLIPS_DIR, CLIP_PRE_EVENT_SEC, CLIP_POST_EVENT_SEC, CLIP_BUFFER_MAX_BYTES,
+                                 CLIP_FALLBACK_FPS, on_saved=mark_clip_ready)
+    zone_store = ZoneStore(ZONES_CONFIG_PATH, ZONES_MAX_PER_CAMERA)
+    for camera_id, video_path in CAMERAS.items():
+        cameras[camera_id] = CameraState(camera_id, video_path)
+
+
+def pipeline_stat_samples(stat_name):
+    with lock:
+        return [({'camera': camera.camera_id}, camera.pipeline_stats[stat_name]) for camera in cameras.values()]
+
+
+metrics.counter('frames_captured_total', 'Frames leídos de la fuente.', ('camera',),
+                callback=lambda: pipeline_stat_samples('frames_captured'))
+metrics.counter('frames_processed_total', 'Frames procesados por el pipeline.', ('camera',),
+                callback=lambda: pipeline_stat_samples('frames_processed'))
+metrics.counter('frames_dropped_total', 'Frames capturados y descartados porque el pipeline iba por detrás.', ('camera',),
+                callback=lambda: pipeline_stat_samples('frames_dropped_capture'))
+metrics.gauge('processed_fps', 'Frames procesados por segundo (media móvil exponencial).', ('camera',),
+              callback=lambda: pipeline_stat_samples('processed_fps'))
+metrics.gauge('stream_clients', 'Clientes conectados al stream de vídeo.', ('camera',),
+              callback=lambda: [({'camera': camera.camera_id}, camera.frame_hub.subscribers)
+                                for camera in cameras.values()])
+metrics.gauge('alarms_open', 'Alarmas abiertas por estado y tipo.', ('status', 'type'),
+              callback=lambda: [({'status': status, 'type': alarm_type}, count)
+                                for (status, alarm_type), count in sorted(alarm_store.totals().items())])
+metrics.gauge('clip_buffer_bytes', 'Bytes de JPEG retenidos en el buffer de clips.', ('camera',),
+              callback=lambda: [({'camera': camera_id}, nbytes)
+                                for camera_id, nbytes in clip_recorder.buffer_bytes().items()])
+metrics.counter('clips_written_total', 'Clips de evidencia escritos a disco.',
+                callback=lambda: [({}, clip_recorder.clips_written)])
+metrics.gauge('model_load_seconds', 'Tiempo de carga y calentamiento de cada modelo (vacío mientras carga).', ('model',),
+              callback=lambda: [({'model': name}, info['load_time_sec'])
+                                for name, info in model_lifecycle.snapshot().items() if info['load_time_sec'] is not None])
+metrics.counter('inference_worker_restarts_total', 'Procesos de inferencia relanzados tras morir.',
+                callback=lambda: [({}, inference_pool.stats.get('restarts', 0) if inference_pool else 0)])
+metrics.gauge('profiler_running', 'Vale 1 si el profiler de muestreo está activo.',
+              callback=lambda: [({}, int(profiler.running))])
+
+
+class LatestFrameBuffer:
+    """Buffer de un solo hueco: guarda solo el último frame publicado.
+
+    Si el consumidor va más lento que el productor, los frames no leídos se
+    sobrescriben (y se cuentan como descartados) en lugar de acumularse.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+        self._consumed_seq = 0
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, frame, capture_ts):
+        with self._cond:
+            if self._item is not None and self._consumed_seq < self._seq:
+                self.dropped += 1
+            self._seq += 1
+            self._item = (frame, capture_ts, self._seq)
+            self._cond.notify_all()
+
+    def get(self, last_seq=0, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or self._seq > last_seq, timeout=timeout):
+                return None
+            if self._seq <= last_seq:
+                return None
+            self._consumed_seq = self._seq
+            return self._item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+def is_file_source(video_path):
+    return isinstance(video_path, str) and video_path != '0' and not video_path.isdigit() \
+        and not video_path.lower().startswith(('rtsp://', 'http://', 'https://'))
+
+
+def capture_frames(camera, frame_buffer):
+    video_path = camera.video_path
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"[{camera.camera_id}] Error: No se pudo abrir el video/cámara en '{video_path}'")
+        frame_buffer.close()
+        return
+
+    from_file = is_file_source(video_path)
+    file_fps = cap.get(cv2.CAP_PROP_FPS) if from_file else 0
+    frame_interval = 1.0 / file_fps if file_fps and file_fps > 0 else 0
+    next_frame_time = time.time()
+    reconnect_attempts = 0
+
+    while not stop_processing_flag.is_set():
+        read_started = time.perf_counter()
+        ret, frame = cap.read()
+        observe_stage(camera, 'capture', read_started)
+        if not ret:
+            if from_file:
+                print(f"[{camera.camera_id}] Fin del video. Reiniciando vídeo.")
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                continue
+            reconnect_attempts += 1
+            if reconnect_attempts > CAPTURE_MAX_RECONNECT_ATTEMPTS:
+                print(f"[{camera.camera_id}] Error al leer frame de la cámara. Deteniendo captura.")
+                break
+            print(f"[{camera.camera_id}] Error al leer frame. Reintentando conexión ({reconnect_attempts}/{CAPTURE_MAX_RECONNECT_ATTEMPTS})...")
+            cap.release()
+            time.sleep(CAPTURE_RECONNECT_DELAY_SEC)
+            cap = cv2.VideoCapture(video_path)
+            continue
+        reconnect_attempts = 0
+
+        capture_ts = camera.clock.time()
+        frame_buffer.put(frame, capture_ts)
+        with lock:
+            camera.pipeline_stats['frames_captured'] += 1
+            camera.pipeline_stats['frames_dropped_capture'] = frame_buffer.dropped
+
+        # Los ficheros se decodifican mucho más rápido que el tiempo real:
+        # se reproducen a su FPS nominal para que los temporizadores tengan sentido.
+        if frame_interval:
+            next_frame_time += frame_interval
+            sleep_time = next_frame_time - time.time()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+            else:
+                next_frame_time = time.time()
+
+    cap.release()
+    frame_buffer.close()
+
+
+ALARM_COOLDOWNS_SEC = {
+    'caida': ALARM_COOLDOWN_SEC_FALL,
+    'fuego_desatendido': ALARM_COOLDOWN_SEC_UNATTENDED_FIRE,
+    'luz_olvidada': LIGHT_ALARM_COOLDOWN_SEC,
+}
+
+
+def observe_stage(camera, stage, started_at):
+    """Registra la duración de una etapa del pipeline; devuelve el instante final para encadenar etapas."""
+    now = time.perf_counter()
+    frame_stage_seconds.observe(now - started_at, camera=camera.camera_id, stage=stage)
+    return now
+
+
+def create_new_alarm(camera, alarm_type="caida", capture_ts=None, track=None):
+    global lock
+    current_time = camera.clock.time()
+
+    cooldown = ALARM_COOLDOWNS_SEC.get(alarm_type, 0)
+    if track is not None:
+        # Cooldown por persona: el del propio track y, por si el tracker la perdió y le asignó un track
+        # nuevo, el de las alarmas recientes en el mismo sitio. Otra persona en otro sitio sí alarma.
+        camera.recent_track_alarms = [(alarmed_type, box, alarm_time)
+                                      for alarmed_type, box, alarm_time in camera.recent_track_alarms
+                                      if current_time - alarm_time < ALARM_COOLDOWNS_SEC.get(alarmed_type, 0)]
+        if current_time - track.last_alarm_time < cooldown:
             return None
-        last_unattended_fire_alarm_time = current_time
-    elif alarm_type == "luz_olvidada":
-        if current_time - last_light_alarm_time < LIGHT_ALARM_COOLDOWN_SEC:
+        track_box = track.box
+        if any(alarmed_type == alarm_type and iou_matrix([track_box], [box])[0, 0] >= FALL_ALARM_SUPPRESS_IOU
+               for alarmed_type, box, _ in camera.recent_track_alarms):
             return None
-        last_light_alarm_time = current_time
+        track.last_alarm_time = current_time
+        camera.recent_track_alarms.append((alarm_type, track_box, current_time))
+    elif alarm_type in camera.last_alarm_time and current_time - camera.last_alarm_time[alarm_type] < cooldown:
+        return None
+    camera.last_alarm_time[alarm_type] = current_time
 
     alarm_id = str(uuid.uuid4())
-    timestamp = datetime.now()
+    timestamp = camera.clock.now()
+    if CLIP_RECORDING_ENABLED:
+        clip_recorder.trigger(camera.camera_id, alarm_id, capture_ts if capture_ts is not None else current_time)
+        # La evidencia se sirve por las rutas de descarga; las rutas en disco no salen del servidor.
+        snapshot_url, clip_url = f'/alarms/{alarm_id}/snapshot', f'/alarms/{alarm_id}/clip'
+    else:
+        snapshot_url, clip_url = None, None
     new_alarm = {
         'id': alarm_id,
+        'camera_id': camera.camera_id,
+        'track_id': track.track_id if track is not None else None,
         'type': alarm_type,
         'timestamp_detected': timestamp.isoformat(),
         'status': 'new',
         'last_status_change': timestamp.isoformat(),
-        'snapshot_path': None
+        'snapshot_url': snapshot_url,
+        'clip_url': clip_url,
+        'clip_ready': False,
+        'capture_to_alarm_latency_sec': round(current_time - capture_ts, 3) if capture_ts is not None else None
     }
+    alarm_store.add(new_alarm)
+    alarms_created_total.inc(camera=camera.camera_id, type=alarm_type)
     with lock:
-        active_alarms_shared.append(new_alarm)
-        print(f"NUEVA ALARMA GENERADA: ID={alarm_id}, Tipo={alarm_type}, Hora={timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
+        if capture_ts is not None:
+            camera.pipeline_stats['last_capture_to_alarm_latency_sec'] = new_alarm['capture_to_alarm_latency_sec']
+        print(f"NUEVA ALARMA GENERADA: ID={alarm_id}, Cámara={camera.camera_id}, Tipo={alarm_type}, Hora={timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
     return new_alarm
 
 
-def video_processing():
-    global output_frame, general_status_text_shared, general_status_class_shared, lock, active_alarms_shared
+def filter_detections(detections, class_ids, min_confidence):
+    """Filtra en bloque un array (N, 6) de detecciones por clase y confianza."""
+    keep = np.isin(detections[:, 5], class_ids) & (detections[:, 4] >= min_confidence)
+    return detections[keep]
 
-    cap = cv2.VideoCapture(VIDEO_PATH)
-    if not cap.isOpened():
-        print(f"Error: No se pudo abrir el video/cámara en '{VIDEO_PATH}'")
-        with lock:
-            general_status_text_shared = "Encienda la cámara para iniciar el procesamiento."
-            general_status_class_shared = "status-alarm-active"
-        return
 
-    print("Procesamiento de vídeo iniciado...")
-    person_potentially_fallen_since = None
-    last_light_check_time = 0.0
-    light_is_on_state = False
-    light_on_no_person_start_time = None
-    fire_detected_continuously_since = None
-    last_person_seen_timestamp = time.time()
-    potential_unattended_fire_alerted_this_cycle = False
+def person_detections_from_results(results_person):
+    return filter_detections(results_person, person_class_ids, MIN_CONFIDENCE_PERSON)[:, :5]
 
-    while not stop_processing_flag.is_set():
-        ret, frame = cap.read()
-        if not ret:
-            print("Fin del video o error al leer frame. Reiniciando vídeo si es un archivo.")
-            if isinstance(VIDEO_PATH, str) and VIDEO_PATH != '0' and VIDEO_PATH != 0:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                continue
-            else:
-                break
 
-        current_processing_time = time.time()
-        frame = cv2.resize(frame, (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT))
-        processed_frame_for_display = frame.copy()
-
-        fall_candidate_this_frame = False
-        yolo_found_person_this_frame = False
-        yolo_found_fire_this_frame = False
-
-        if model_person and classnames_person:
-            results_person = model_person(frame, verbose=False, conf=MIN_CONFIDENCE_PERSON)
-            for info in results_person:
-                parameters = info.boxes
-                for box in parameters:
-                    x1_p, y1_p, x2_p, y2_p = box.xyxy[0]
-                    x1_p, y1_p, x2_p, y2_p = int(x1_p), int(y1_p), int(x2_p), int(y2_p)
-                    confidence_p = box.conf[0]
-                    class_detect_idx_p = int(box.cls[0])
-                    if class_detect_idx_p < len(classnames_person):
-                        class_name_p = classnames_person[class_detect_idx_p]
-                        if class_name_p == 'person':
-                            yolo_found_person_this_frame = True
-                            last_person_seen_timestamp = current_processing_time
-                            
-                            height_p = y2_p - y1_p
-                            width_p = x2_p - x1_p
-                            cvzone.cornerRect(processed_frame_for_display, [x1_p, y1_p, width_p, height_p], l=20, rt=4,
-                                              colorR=(0, 255, 0), colorC=(0, 255, 0))
-                            cvzone.putTextRect(processed_frame_for_display, f'Persona {math.ceil(confidence_p * 100)}%',
-                                               [x1_p + 5, y1_p - 10], thickness=1, scale=1, colorR=(0, 255, 0))
-                            aspect_ratio_p = height_p / width_p if width_p > 0 else float('inf')
-                            if aspect_ratio_p < ASPECT_RATIO_THRESHOLD:
-                                fall_candidate_this_frame = True
-                                if person_potentially_fallen_since is None:
-                                    person_potentially_fallen_since = current_processing_time
-                                else:
-                                    duration_fallen = current_processing_time - person_potentially_fallen_since
-                                    cvzone.putTextRect(processed_frame_for_display, f'Posible caida: {duration_fallen:.1f}s',
-                                                       [x1_p, y2_p + 15], scale=1, thickness=1, colorR=(50,50,255), offset=3)
-                                    if duration_fallen > MIN_FALL_DURATION_SEC:
-                                        if create_new_alarm(alarm_type="caida"):
-                                            person_potentially_fallen_since = None
-        if not fall_candidate_this_frame and person_potentially_fallen_since is not None:
-            person_potentially_fallen_since = None
-
-        if model_fire and classnames_fire:
-            results_fire = model_fire(frame, verbose=False, conf=MIN_CONFIDENCE_FIRE)
-            temp_fire_detected_in_current_model_run = False
-            for info in results_fire:
-                boxes = info.boxes
-                for box in boxes:
-                    confidence_f = box.conf[0]
-                    Class_f = int(box.cls[0])
-                    if Class_f < len(classnames_fire):
-                        class_name_fire = classnames_fire[Class_f]
-                        if class_name_fire == 'fire':
-                            yolo_found_fire_this_frame = True
-                            temp_fire_detected_in_current_model_run = True
-                            x1_f, y1_f, x2_f, y2_f = box.xyxy[0]
-                            x1_f, y1_f, x2_f, y2_f = int(x1_f), int(y1_f), int(x2_f), int(y2_f)
-                            cv2.rectangle(processed_frame_for_display, (x1_f, y1_f), (x2_f, y2_f), (0, 0, 255), 3)
-                            cvzone.putTextRect(processed_frame_for_display, f'FUEGO {math.ceil(confidence_f * 100)}%',
-                                               [x1_f + 8, y1_f - 10 if y1_f > 20 else y1_f + 25],
-                                               scale=1.2, thickness=2, colorR=(0,0,255), colorT=(255,255,255))
-                            break
-                if temp_fire_detected_in_current_model_run:
-                    break
-            
-            if yolo_found_fire_this_frame:
-                if fire_detected_continuously_since is None:
-                    fire_detected_continuously_since = current_processing_time
-                    potential_unattended_fire_alerted_this_cycle = False
-                    print(f"DEBUG FUEGO: Fuego detectado. Iniciando contador. Persona presente: {yolo_found_person_this_frame}")
-                
-                time_since_last_person = current_processing_time - last_person_seen_timestamp
-                fire_duration = current_processing_time - fire_detected_continuously_since
-
-                cvzone.putTextRect(processed_frame_for_display, f"Fuego: {fire_duration:.1f}s", [10,30], scale=1, thickness=1, offset=3)
-                cvzone.putTextRect(processed_frame_for_display, f"Sin Persona: {time_since_last_person:.1f}s", [10,60], scale=1, thickness=1, offset=3)
-
-                if not yolo_found_person_this_frame:
-                    if fire_duration >= FIRE_UNATTENDED_DURATION_SEC and \
-                       time_since_last_person >= FIRE_UNATTENDED_DURATION_SEC and \
-                       not potential_unattended_fire_alerted_this_cycle:
-                        print(f"DEBUG FUEGO: ¡CONDICIÓN DE ALARMA FUEGO DESATENDIDO! Fuego por {fire_duration:.1f}s, Sin persona por {time_since_last_person:.1f}s.")
-                        if create_new_alarm(alarm_type="fuego_desatendido"):
-                            potential_unattended_fire_alerted_this_cycle = True
-                else:
-                    potential_unattended_fire_alerted_this_cycle = False
+def process_frame(camera, frame, capture_ts):
+    """Pasa un frame por todo el pipeline: gate de movimiento, detección, tracking, alarmas, estado y publicación."""
+    # Los temporizadores usan la hora de captura del frame, no la de procesado.
+    current_processing_time = capture_ts
+    stage_started = time.perf_counter()
+    full_frame = frame
+    frame = cv2.resize(frame, (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT))
+    processed_frame_for_display = frame.copy()
+    stage_started = observe_stage(camera, 'resize', stage_started)
 
+    yolo_found_person_this_frame = False
+    yolo_found_fire_this_frame = False
+
+    fall_timer_running = camera.person_potentially_fallen_since is not None
+    if MOTION_GATE_ENABLED:
+        # Con un temporizador de caída o de fuego en marcha no se salta el modelo correspondiente.
+        gate_person, run_fire = camera.motion_gate.decide(
+            frame, current_processing_time,
+            force_person=fall_timer_running,
+            force_fire=camera.fire_detected_continuously_since is not None)
+    else:
+        gate_person, run_fire = True, True
+    # Entre detecciones el tracker propaga las cajas; el detector se ejecuta cada
+    # DETECT_EVERY_N_FRAMES frames, antes si algún track pierde confianza, y en todos
+    # mientras corre un temporizador de caída (la relación de aspecto debe ser la medida).
+    detection_due = (not camera.tracker.tracks or fall_timer_running
+                     or camera.frames_since_person_detection + 1 >= DETECT_EVERY_N_FRAMES)
+    run_person = camera.tracker.needs_detection(TRACK_MIN_CONFIDENCE) or (gate_person and detection_due)
+    stage_started = observe_stage(camera, 'motion_gate', stage_started)
+
+    camera.refresh_zones()
+    pool = ready_inference_pool()
+    fire_crops, fire_transforms = None, None
+    if pool is not None and run_fire and camera.fire_zones:
+        # Los recortes salen del frame original: las llamas pequeñas no pierden detalle con el reescalado.
+        fire_crops, fire_transforms = zone_crops(full_frame, camera.fire_zones, ZONE_CROP_SIZE)
+        stage_started = observe_stage(camera, 'zone_crops', stage_started)
+
+    if pool is None:
+        # Modelos aún cargando (o sin ninguno disponible): el frame sigue su camino sin detección.
+        run_person = run_fire = False
+        new_results_person, new_results_fire = None, None
+    else:
+        new_results_person, new_results_fire = pool.infer(camera.camera_id, frame, run_person, run_fire, fire_crops)
+        if fire_transforms is not None and new_results_fire is not None:
+            full_height, full_width = full_frame.shape[:2]
+            new_results_fire = crop_detections_to_frame(new_results_fire, fire_transforms,
+                                                        FRAME_PROCESS_WIDTH / full_width,
+                                                        FRAME_PROCESS_HEIGHT / full_height)
+    stage_started = observe_stage(camera, 'inference', stage_started)
+    if run_person:
+        camera.motion_gate.mark_run('person', current_processing_time)
+    if run_fire:
+        camera.motion_gate.mark_run('fire', current_processing_time)
+        camera.last_results_fire = new_results_fire
+    results_fire = camera.last_results_fire
+
+    if run_person and new_results_person is not None:
+        camera.tracker.update(person_detections_from_results(new_results_person), current_processing_time)
+        camera.frames_since_person_detection = 0
+    else:
+        camera.tracker.predict(current_processing_time)
+        camera.frames_since_person_detection += 1
+
+    draw_zones(processed_frame_for_display, camera.zones)
+
+    tracks = camera.tracker.tracks
+    track_boxes = np.array([track.box for track in tracks], dtype=np.float32).reshape(-1, 4).astype(np.int32)
+    widths_p = track_boxes[:, 2] - track_boxes[:, 0]
+    heights_p = track_boxes[:, 3] - track_boxes[:, 1]
+    # alto / ancho < umbral, sin dividir: una caja sin ancho nunca cuenta como caída.
+    lying_p = (widths_p > 0) & (heights_p < ASPECT_RATIO_THRESHOLD * widths_p)
+
+    fallen_since_times = []
+    for track, (x1_p, y1_p, x2_p, y2_p), is_lying in zip(tracks, track_boxes.tolist(), lying_p.tolist()):
+        yolo_found_person_this_frame = True
+        camera.last_person_seen_timestamp = current_processing_time
+
+        confidence_p = track.confidence
+        cvzone.cornerRect(processed_frame_for_display, [x1_p, y1_p, x2_p - x1_p, y2_p - y1_p], l=20, rt=4,
+                          colorR=(0, 255, 0), colorC=(0, 255, 0))
+        cvzone.putTextRect(processed_frame_for_display, f'Persona #{track.track_id} {math.ceil(confidence_p * 100)}%',
+                           [x1_p + 5, y1_p - 10], thickness=1, scale=1, colorR=(0, 255, 0))
+        if is_lying and track.hits >= TRACK_MIN_HITS:
+            if track.fallen_since is None:
+                track.fallen_since = current_processing_time
             else:
-                if fire_detected_continuously_since is not None:
-                    print(f"DEBUG FUEGO: Fuego ya no detectado. Reseteando contador de fuego.")
-                fire_detected_continuously_since = None
-                potential_unattended_fire_alerted_this_cycle = False
-
-        if current_processing_time - last_light_check_time >= LIGHT_CHECK_INTERVAL_SEC:
-            last_light_check_time = current_processing_time
-            current_system_hour = datetime.now().hour
-
-            if HOUR_START_LIGHT_CHECK <= current_system_hour < HOUR_END_LIGHT_CHECK:
-                gray_frame_for_light = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                current_brightness = np.mean(gray_frame_for_light)
-
-                if not light_is_on_state and current_brightness > LIGHT_BRIGHTNESS_THRESHOLD_ON:
-                    light_is_on_state = True
-                elif light_is_on_state and current_brightness < LIGHT_BRIGHTNESS_THRESHOLD_OFF:
-                    light_is_on_state = False
-                    light_on_no_person_start_time = None
-
-                if light_is_on_state:
-                    if light_on_no_person_start_time is None:
-                        light_on_no_person_start_time = current_processing_time
-                    
-                    if (current_processing_time - light_on_no_person_start_time) >= LIGHT_ON_NO_PERSON_DURATION_ALARM_SEC:
-                        if create_new_alarm(alarm_type="luz_olvidada"):
-                            light_on_no_person_start_time = None
-            else:
-                light_is_on_state = False
-                light_on_no_person_start_time = None
+                duration_fallen = current_processing_time - track.fallen_since
+                cvzone.putTextRect(processed_frame_for_display, f'Posible caida: {duration_fallen:.1f}s',
+                                   [x1_p, y2_p + 15], scale=1, thickness=1, colorR=(50,50,255), offset=3)
+                if duration_fallen > MIN_FALL_DURATION_SEC:
+                    if create_new_alarm(camera, alarm_type="caida", capture_ts=capture_ts, track=track):
+                        track.fallen_since = None
+        else:
+            track.fallen_since = None
+        if track.fallen_since is not None:
+            fallen_since_times.append(track.fallen_since)
+    camera.person_potentially_fallen_since = min(fallen_since_times) if fallen_since_times else None
+
+    if results_fire is not None:
+        fire_detections = filter_detections(results_fire, fire_class_ids, MIN_CONFIDENCE_FIRE)
+        if len(fire_detections):
+            yolo_found_fire_this_frame = True
+            # Se dibuja solo la detección de fuego más segura.
+            x1_f, y1_f, x2_f, y2_f, confidence_f = fire_detections[np.argmax(fire_detections[:, 4]), :5]
+            x1_f, y1_f, x2_f, y2_f = int(x1_f), int(y1_f), int(x2_f), int(y2_f)
+            cv2.rectangle(processed_frame_for_display, (x1_f, y1_f), (x2_f, y2_f), (0, 0, 255), 3)
+            cvzone.putTextRect(processed_frame_for_display, f'FUEGO {math.ceil(confidence_f * 100)}%',
+                               [x1_f + 8, y1_f - 10 if y1_f > 20 else y1_f + 25],
+                               scale=1.2, thickness=2, colorR=(0,0,255), colorT=(255,255,255))
         
-        with lock:
-            active_new_alarms = [a for a in active_alarms_shared if a['status'] == 'new']
-            active_acknowledged_alarms = [a for a in active_alarms_shared if a['status'] == 'acknowledged']
-
-            is_new_unattended_fire_alarm = any(a['type'] == 'fuego_desatendido' and a['status'] == 'new' for a in active_new_alarms)
-            is_new_fall_alarm = any(a['type'] == 'caida' and a['status'] == 'new' for a in active_new_alarms)
-            is_new_light_alarm = any(a['type'] == 'luz_olvidada' and a['status'] == 'new' for a in active_new_alarms)
-
-            if is_new_unattended_fire_alarm:
-                general_status_text_shared = f"¡ALARMA FUEGO DESATENDIDO ({len([a for a in active_new_alarms if a['type']=='fuego_desatendido'])})!"
-                general_status_class_shared = "status-alarm-critical"
-                if int(current_processing_time * 4) % 2 == 0:
-                     overlay = processed_frame_for_display.copy()
-                     cv2.rectangle(overlay, (0,0), (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT), (0,0,150), -1)
-                     cv2.addWeighted(overlay, 0.7, processed_frame_for_display, 0.3, 0, processed_frame_for_display)
-            elif is_new_fall_alarm:
-                general_status_text_shared = f"¡ALARMA DE CAÍDA ({len([a for a in active_new_alarms if a['type']=='caida'])})!"
-                general_status_class_shared = "status-alarm-active"
-                if int(current_processing_time * 2) % 2 == 0:
-                     overlay = processed_frame_for_display.copy()
-                     cv2.rectangle(overlay, (0,0), (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT), (0,0,100), -1)
-                     cv2.addWeighted(overlay, 0.6, processed_frame_for_display, 0.4, 0, processed_frame_for_display)
-            elif is_new_light_alarm:
-                general_status_text_shared = f"¡ALARMA LUZ ({len([a for a in active_new_alarms if a['type']=='luz_olvidada'])})!"
-                general_status_class_shared = "status-alarm-active"
-                if int(current_processing_time * 1.5) % 2 == 0:
-                     overlay = processed_frame_for_display.copy()
-                     cv2.rectangle(overlay, (0,0), (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT), (0,150,150), -1)
-                     cv2.addWeighted(overlay, 0.3, processed_frame_for_display, 0.7, 0, processed_frame_for_display)
-            elif active_acknowledged_alarms:
-                ack_types = [a['type'] for a in active_acknowledged_alarms]
-                status_parts = []
-                if 'fuego_desatendido' in ack_types: status_parts.append(f"FuegoDes Rec. ({ack_types.count('fuego_desatendido')})")
-                if 'caida' in ack_types: status_parts.append(f"Caída Rec. ({ack_types.count('caida')})")
-                if 'luz_olvidada' in ack_types: status_parts.append(f"Luz Rec. ({ack_types.count('luz_olvidada')})")
-                
-                general_status_text_shared = "Reconocido: " + ", ".join(status_parts) + ". Pendiente."
-                general_status_class_shared = "status-possible-fall"
-            
-            elif person_potentially_fallen_since is not None:
-                duration_display = current_processing_time - person_potentially_fallen_since
-                general_status_text_shared = f"Posible Caida detectada ({duration_display:.1f}s)"
-                general_status_class_shared = "status-possible-fall"
-            
-            elif fire_detected_continuously_since is not None:
-                fire_dur = current_processing_time - fire_detected_continuously_since
-                person_status = "Presente" if yolo_found_person_this_frame else f"Ausente por {(current_processing_time - last_person_seen_timestamp):.0f}s"
-                general_status_text_shared = f"Fuego detectado ({fire_dur:.0f}s). Persona: {person_status}"
-                general_status_class_shared = "status-possible-fall"
+        if yolo_found_fire_this_frame:
+            if camera.fire_detected_continuously_since is None:
+                camera.fire_detected_continuously_since = current_processing_time
+                camera.potential_unattended_fire_alerted_this_cycle = False
+                print(f"DEBUG FUEGO: Fuego detectado. Iniciando contador. Persona presente: {yolo_found_person_this_frame}")
             
+            time_since_last_person = current_processing_time - camera.last_person_seen_timestamp
+            fire_duration = current_processing_time - camera.fire_detected_continuously_since
+
+            cvzone.putTextRect(processed_frame_for_display, f"Fuego: {fire_duration:.1f}s", [10,30], scale=1, thickness=1, offset=3)
+            cvzone.putTextRect(processed_frame_for_display, f"Sin Persona: {time_since_last_person:.1f}s", [10,60], scale=1, thickness=1, offset=3)
+
+            if not yolo_found_person_this_frame:
+                if fire_duration >= FIRE_UNATTENDED_DURATION_SEC and \
+                   time_since_last_person >= FIRE_UNATTENDED_DURATION_SEC and \
+                   not camera.potential_unattended_fire_alerted_this_cycle:
+                    print(f"DEBUG FUEGO: ¡CONDICIÓN DE ALARMA FUEGO DESATENDIDO! Fuego por {fire_duration:.1f}s, Sin persona por {time_since_last_person:.1f}s.")
+                    if create_new_alarm(camera, alarm_type="fuego_desatendido", capture_ts=capture_ts):
+                        camera.potential_unattended_fire_alerted_this_cycle = True
             else:
-                general_status_text_shared = "Normal"
-                general_status_class_shared = "status-normal"
-                if light_is_on_state and HOUR_START_LIGHT_CHECK <= datetime.now().hour < HOUR_END_LIGHT_CHECK and LIGHT_ON_NO_PERSON_DURATION_ALARM_SEC == 1.0:
-                    general_status_text_shared = "Normal (Modo Test Luz ON)"
+                camera.potential_unattended_fire_alerted_this_cycle = False
 
-            ret_jpeg, buffer = cv2.imencode('.jpg', processed_frame_for_display)
-            if ret_jpeg:
-                output_frame = buffer.tobytes()
+        else:
+            if camera.fire_detected_continuously_since is not None:
+                print(f"DEBUG FUEGO: Fuego ya no detectado. Reseteando contador de fuego.")
+            camera.fire_detected_continuously_since = None
+            camera.potential_unattended_fire_alerted_this_cycle = False
+    stage_started = observe_stage(camera, 'decode_draw', stage_started)
 
-    cap.release()
-    print("Procesamiento de vídeo detenido.")
+    if current_processing_time - camera.last_light_check_time >= LIGHT_CHECK_INTERVAL_SEC:
+        camera.last_light_check_time = current_processing_time
+        current_system_hour = camera.clock.now().hour
+
+        if HOUR_START_LIGHT_CHECK <= current_system_hour < HOUR_END_LIGHT_CHECK:
+            gray_frame_for_light = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            # Con zonas de luz solo cuenta el brillo dentro de ellas (p. ej. la lámpara y no la ventana).
+            current_brightness = cv2.mean(gray_frame_for_light, mask=camera.light_mask)[0]
+
+            if not camera.light_is_on_state and current_brightness > LIGHT_BRIGHTNESS_THRESHOLD_ON:
+                camera.light_is_on_state = True
+            elif camera.light_is_on_state and current_brightness < LIGHT_BRIGHTNESS_THRESHOLD_OFF:
+                camera.light_is_on_state = False
+                camera.light_on_no_person_start_time = None
+
+            if camera.light_is_on_state:
+                if camera.light_on_no_person_start_time is None:
+                    camera.light_on_no_person_start_time = current_processing_time
+                
+                if (current_processing_time - camera.light_on_no_person_start_time) >= LIGHT_ON_NO_PERSON_DURATION_ALARM_SEC:
+                    if create_new_alarm(camera, alarm_type="luz_olvidada", capture_ts=capture_ts):
+                        camera.light_on_no_person_start_time = None
+        else:
+            camera.light_is_on_state = False
+            camera.light_on_no_person_start_time = None
+    stage_started = observe_stage(camera, 'brightness', stage_started)
+    
+    new_counts = alarm_store.counts_by_type(camera.camera_id, 'new', ALARM_TYPES)
+    acknowledged_counts = alarm_store.counts_by_type(camera.camera_id, 'acknowledged', ALARM_TYPES)
+    previous_status = (camera.status_text, camera.status_class)
     with lock:
-        general_status_text_shared = "Procesamiento detenido."
-        general_status_class_shared = "status-normal"
-        output_frame = None
-
-def generate_frames():
-    global output_frame, lock
-    while True:
-        time.sleep(0.03) 
+        is_new_unattended_fire_alarm = new_counts['fuego_desatendido'] > 0
+        is_new_fall_alarm = new_counts['caida'] > 0
+        is_new_light_alarm = new_counts['luz_olvidada'] > 0
+
+        if is_new_unattended_fire_alarm:
+            camera.status_text = f"¡ALARMA FUEGO DESATENDIDO ({new_counts['fuego_desatendido']})!"
+            camera.status_class = "status-alarm-critical"
+            if int(current_processing_time * 4) % 2 == 0:
+                 overlay = processed_frame_for_display.copy()
+                 cv2.rectangle(overlay, (0,0), (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT), (0,0,150), -1)
+                 cv2.addWeighted(overlay, 0.7, processed_frame_for_display, 0.3, 0, processed_frame_for_display)
+        elif is_new_fall_alarm:
+            camera.status_text = f"¡ALARMA DE CAÍDA ({new_counts['caida']})!"
+            camera.status_class = "status-alarm-active"
+            if int(current_processing_time * 2) % 2 == 0:
+                 overlay = processed_frame_for_display.copy()
+                 cv2.rectangle(overlay, (0,0), (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT), (0,0,100), -1)
+                 cv2.addWeighted(overlay, 0.6, processed_frame_for_display, 0.4, 0, processed_frame_for_display)
+        elif is_new_light_alarm:
+            camera.status_text = f"¡ALARMA LUZ ({new_counts['luz_olvidada']})!"
+            camera.status_class = "status-alarm-active"
+            if int(current_processing_time * 1.5) % 2 == 0:
+                 overlay = processed_frame_for_display.copy()
+                 cv2.rectangle(overlay, (0,0), (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT), (0,150,150), -1)
+                 cv2.addWeighted(overlay, 0.3, processed_frame_for_display, 0.7, 0, processed_frame_for_display)
+        elif any(acknowledged_counts.values()):
+            status_parts = []
+            if acknowledged_counts['fuego_desatendido']: status_parts.append(f"FuegoDes Rec. ({acknowledged_counts['fuego_desatendido']})")
+            if acknowledged_counts['caida']: status_parts.append(f"Caída Rec. ({acknowledged_counts['caida']})")
+            if acknowledged_counts['luz_olvidada']: status_parts.append(f"Luz Rec. ({acknowledged_counts['luz_olvidada']})")
+            
+            camera.status_text = "Reconocido: " + ", ".join(status_parts) + ". Pendiente."
+            camera.status_class = "status-possible-fall"
+        
+        elif camera.person_potentially_fallen_since is not None:
+            duration_display = current_processing_time - camera.person_potentially_fallen_since
+            camera.status_text = f"Posible Caida detectada ({duration_display:.1f}s)"
+            camera.status_class = "status-possible-fall"
+        
+        elif camera.fire_detected_continuously_since is not None:
+            fire_dur = current_processing_time - camera.fire_detected_continuously_since
+            person_status = "Presente" if yolo_found_person_this_frame else f"Ausente por {(current_processing_time - camera.last_person_seen_timestamp):.0f}s"
+            camera.status_text = f"Fuego detectado ({fire_dur:.0f}s). Persona: {person_status}"
+            camera.status_class = "status-possible-fall"
+        
+        else:
+            camera.status_text = "Normal" if pool is not None else "Normal (cargando modelos de detección...)"
+            camera.status_class = "status-normal"
+            if camera.light_is_on_state and HOUR_START_LIGHT_CHECK <= camera.clock.now().hour < HOUR_END_LIGHT_CHECK and LIGHT_ON_NO_PERSON_DURATION_ALARM_SEC == 1.0:
+                camera.status_text = "Normal (Modo Test Luz ON)"
+
+        camera.pipeline_stats['frames_processed'] += 1
+        camera.pipeline_stats['last_frame_latency_sec'] = round(camera.clock.time() - capture_ts, 3)
+        if camera.last_processed_at is not None and stage_started > camera.last_processed_at:
+            instant_fps = 1.0 / (stage_started - camera.last_processed_at)
+            camera.pipeline_stats['processed_fps'] += FPS_EMA_ALPHA * (instant_fps - camera.pipeline_stats['processed_fps'])
+        camera.last_processed_at = stage_started
+    if (camera.status_text, camera.status_class) != previous_status:
+        status_notifier.bump()
+
+    # Solo se publica la referencia al frame; se codifica bajo demanda si hay clientes.
+    frame_seq = camera.frame_hub.publish(processed_frame_for_display)
+    stage_started = observe_stage(camera, 'status_publish', stage_started)
+
+    if CLIP_RECORDING_ENABLED:
+        if camera.clip_encode_slots.acquire(blocking=False):
+            camera.clip_encode_executor.submit(buffer_clip_frame, camera, frame_seq, processed_frame_for_display,
+                                               capture_ts)
+        else:
+            with lock:
+                camera.pipeline_stats['clip_frames_skipped'] += 1
+        observe_stage(camera, 'clip_buffer', stage_started)
+
+
+def buffer_clip_frame(camera, frame_seq, frame, capture_ts):
+    # Comparte la codificación con los clientes del stream que pidan el mismo tier y justo ese frame.
+    try:
+        jpeg_bytes = camera.frame_hub.encode(frame_seq, frame, CLIP_FRAME_WIDTH, CLIP_JPEG_QUALITY, exact=True)
+        if jpeg_bytes:
+            clip_recorder.add_frame(camera.camera_id, capture_ts, jpeg_bytes)
+    except Exception as e:
+        print(f"Error al codificar el frame para el buffer de clips de la cámara {camera.camera_id}: {e}")
+    finally:
+        camera.clip_encode_slots.release()
+
+
+def drain_clip_encoder(camera):
+    """Espera a que se hayan añadido al buffer de clips todos los frames de la cámara ya enviados a codificar."""
+    camera.clip_encode_executor.submit(lambda: None).result()
+
+
+def video_processing(camera):
+    global lock
+
+    frame_buffer = LatestFrameBuffer()
+    capture_thread = threading.Thread(target=capture_frames, args=(camera, frame_buffer), daemon=True)
+    capture_thread.start()
+
+    first_item = frame_buffer.get(0)
+    if first_item is None:
         with lock:
-            if output_frame is None:
-                blank_frame = np.zeros((FRAME_PROCESS_HEIGHT, FRAME_PROCESS_WIDTH, 3), dtype=np.uint8)
-                placeholder = cv2.imread("placeholder.jpg")
-                if placeholder is not None:
-                    try:
-                        blank_frame = cv2.resize(placeholder, (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT))
-                    except Exception: 
-                         cv2.putText(blank_frame, "Sin Senal", (50, FRAME_PROCESS_HEIGHT // 2), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            camera.status_text = "Encienda la cámara para iniciar el procesamiento."
+            camera.status_class = "status-alarm-active"
+        status_notifier.bump()
+        return
+
+    print(f"[{camera.camera_id}] Procesamiento de vídeo iniciado...")
+    item = first_item
+
+    while not stop_processing_flag.is_set():
+        if item is None:
+            item = frame_buffer.get(last_seq, timeout=PIPELINE_WAIT_TIMEOUT_SEC)
+            if item is None:
+                if frame_buffer.closed:
+                    break
+                continue
+        frame, capture_ts, last_seq = item
+        item = None
+        process_frame(camera, frame, capture_ts)
+
+    capture_thread.join(timeout=5)
+    drain_clip_encoder(camera)
+    clip_recorder.flush(camera.camera_id)
+    print(f"[{camera.camera_id}] Procesamiento de vídeo detenido.")
+    with lock:
+        camera.status_text = "Procesamiento detenido."
+        camera.status_class = "status-normal"
+    status_notifier.bump()
+    camera.frame_hub.publish(None)
+
+def build_placeholder_jpeg():
+    blank_frame = np.zeros((FRAME_PROCESS_HEIGHT, FRAME_PROCESS_WIDTH, 3), dtype=np.uint8)
+    placeholder = cv2.imread("placeholder.jpg")
+    if placeholder is not None:
+        try:
+            blank_frame = cv2.resize(placeholder, (FRAME_PROCESS_WIDTH, FRAME_PROCESS_HEIGHT))
+        except Exception: 
+             cv2.putText(blank_frame, "Sin Senal", (50, FRAME_PROCESS_HEIGHT // 2), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+    else:
+        cv2.putText(blank_frame, "Sin Senal", (50, FRAME_PROCESS_HEIGHT // 2), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+    ret_jpeg, buffer = cv2.imencode('.jpg', blank_frame)
+    return buffer.tobytes() if ret_jpeg else b''
+
+placeholder_jpeg = build_placeholder_jpeg()
+encode_executor = ThreadPoolExecutor(max_workers=STREAM_ENCODE_WORKERS, thread_name_prefix='jpeg')
+
+def parse_stream_tier(args):
+    try:
+        requested_width = int(args.get('w', FRAME_PROCESS_WIDTH))
+    except ValueError:
+        requested_width = FRAME_PROCESS_WIDTH
+    # Se ajusta al tier más cercano por debajo para que los clientes compartan codificación.
+    width = max([w for w in STREAM_TIER_WIDTHS if w <= requested_width] or [min(STREAM_TIER_WIDTHS)])
+    try:
+        quality = int(args.get('q', STREAM_DEFAULT_QUALITY))
+    except ValueError:
+        quality = STREAM_DEFAULT_QUALITY
+    quality = min(max(int(round(quality / 10.0)) * 10, STREAM_MIN_QUALITY), STREAM_MAX_QUALITY)
+    try:
+        fps = float(args.get('fps', 0))
+    except ValueError:
+        fps = 0
+    fps = min(max(fps, 0), STREAM_MAX_FPS)
+    return width, quality, fps
+
+async def generate_frames(camera, width, quality, fps):
+    hub = camera.frame_hub
+    loop = asyncio.get_running_loop()
+    min_interval = 1.0 / fps if fps else 0
+    hub.add_subscriber()
+    try:
+        last_seq = -1
+        frame_bytes = None
+        while True:
+            item = await hub.wait_for_frame(last_seq, timeout=STREAM_KEEPALIVE_SEC)
+            if item is not None:
+                last_seq, frame = item
+                if frame is None:
+                    frame_bytes = placeholder_jpeg
                 else:
-                    cv2.putText(blank_frame, "Sin Senal", (50, FRAME_PROCESS_HEIGHT // 2), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                ret_jpeg, buffer = cv2.imencode('.jpg', blank_frame)
-                if not ret_jpeg: continue
-                frame_bytes = buffer.tobytes()
-            else:
-                frame_bytes = output_frame
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+                    frame_bytes = await loop.run_in_executor(encode_executor, hub.encode, last_seq, frame,
+                                                             width, quality)
+            # Sin frames nuevos se reenvía el último para mantener viva la conexión.
+            if frame_bytes is None:
+                frame_bytes = placeholder_jpeg
+            sent_at = loop.time()
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            if min_interval:
+                await asyncio.sleep(max(0.0, min_interval - (loop.time() - sent_at)))
+    finally:
+        hub.remove_subscriber()
+
+def update_general_status():
+    global general_status_text_shared, general_status_class_shared
+    if not cameras:
+        return
+    worst_camera = max(cameras.values(), key=lambda c: STATUS_CLASS_SEVERITY.get(c.status_class, 0))
+    if len(cameras) == 1:
+        general_status_text_shared = worst_camera.status_text
+    elif STATUS_CLASS_SEVERITY.get(worst_camera.status_class, 0) == 0:
+        general_status_text_shared = "Normal"
+    else:
+        general_status_text_shared = f"{worst_camera.camera_id}: {worst_camera.status_text}"
+    general_status_class_shared = worst_camera.status_class
 
 @app.route('/')
-def index():
-    return render_template('index.html')
+async def index():
+    return await render_template('index.html', camera_ids=list(cameras.keys()))
 
 @app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+@app.route('/video_feed/<camera_id>')
+async def video_feed(camera_id=None):
+    if camera_id is None:
+        camera_id = next(iter(cameras))
+    camera = cameras.get(camera_id)
+    if camera is None:
+        return jsonify({"message": f"Cámara {camera_id} no encontrada."}), 404
+    width, quality, fps = parse_stream_tier(request.args)
+    response = Response(generate_frames(camera, width, quality, fps),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.timeout = None
+    return response
 
-@app.route('/get_status_and_alarms')
-def get_status_and_alarms():
-    global general_status_text_shared, general_status_class_shared, active_alarms_shared, lock
+def current_status_payload():
+    """Devuelve (versión, JSON) del estado y las alarmas; se serializa una sola vez por versión."""
+    global general_status_text_shared, general_status_class_shared, lock
+    version = status_notifier.version
     with lock:
-        def sort_key(alarm):
-            status_order = {'new': 0, 'acknowledged': 1}
-            type_order = {'fuego_desatendido': 0, 'fuego': 1, 'caida': 2, 'luz_olvidada': 3} 
-            return (status_order.get(alarm['status'], 99), 
-                    type_order.get(alarm['type'], 99),
-                    alarm['timestamp_detected'])
-        alarms_to_display = sorted(
-            [a for a in active_alarms_shared if a['status'] != 'resolved' and a['status'] != 'false_positive'],
-            key=sort_key 
-        )
-        return jsonify({
+        if status_payload_cache['version'] == version:
+            return version, status_payload_cache['body']
+    def sort_key(alarm):
+        status_order = {'new': 0, 'acknowledged': 1}
+        type_order = {'fuego_desatendido': 0, 'fuego': 1, 'caida': 2, 'luz_olvidada': 3} 
+        return (status_order.get(alarm['status'], 99), 
+                type_order.get(alarm['type'], 99),
+                alarm['timestamp_detected'])
+    # El almacén solo guarda alarmas abiertas: no hace falta filtrar las cerradas.
+    alarms_to_display = sorted(alarm_store.active(), key=sort_key)
+    with lock:
+        update_general_status()
+        body = json.dumps({
+            "version": version,
             "general_status_text": general_status_text_shared,
             "general_status_class": general_status_class_shared,
-            "alarms": alarms_to_display
+            "alarms": alarms_to_display,
+            "cameras": [camera.status_dict() for camera in cameras.values()],
         })
+        status_payload_cache['version'] = version
+        status_payload_cache['body'] = body
+    return version, body
 
-@app.route('/manage_alarm/<alarm_id>/<action>', methods=['POST'])
-def manage_alarm_route(alarm_id, action):
-    global active_alarms_shared, lock 
-    message = "Acción no reconocida o alarma no encontrada."
-    success = False
+@app.route('/get_status_and_alarms')
+async def get_status_and_alarms():
+    version, body = current_status_payload()
+    etag = f'"{version}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return '', 304, {'ETag': etag}
+    return Response(body, mimetype='application/json', headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+@app.route('/events')
+async def status_events():
+    async def event_stream():
+        last_version = -1
+        while True:
+            version, body = current_status_payload()
+            if version != last_version:
+                last_version = version
+                yield f"id: {version}\nevent: status\ndata: {body}\n\n".encode()
+                # Agrupa ráfagas de cambios (p. ej. contadores en pantalla) en un único envío.
+                await asyncio.sleep(SSE_MIN_INTERVAL_SEC)
+            if await status_notifier.wait_for_change(last_version, timeout=SSE_KEEPALIVE_SEC) is None:
+                yield b": keepalive\n\n"
+
+    response = Response(event_stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
+@app.route('/stats')
+async def pipeline_stats_route():
     with lock:
-        alarm_found = None
-        for alarm in active_alarms_shared:
-            if alarm['id'] == alarm_id:
-                alarm_found = alarm
-                break
-        if alarm_found:
-            current_time_iso = datetime.now().isoformat()
-            alarm_type_display = alarm_found['type'].replace('_', ' ').title()
-
-            if action == 'acknowledge' and alarm_found['status'] == 'new':
-                alarm_found['status'] = 'acknowledged'
-                alarm_found['last_status_change'] = current_time_iso
-                message = f"Alarma {alarm_id[:8]} ({alarm_type_display}) reconocida."
-                success = True
-            elif action == 'resolve' and alarm_found['status'] == 'acknowledged':
-                alarm_found['status'] = 'resolved'
-                alarm_found['last_status_change'] = current_time_iso
-                message = f"Alarma {alarm_id[:8]} ({alarm_type_display}) resuelta."
-                success = True
-            elif action == 'false_positive' and (alarm_found['status'] == 'new' or alarm_found['status'] == 'acknowledged'):
-                alarm_found['status'] = 'false_positive'
-                alarm_found['last_status_change'] = current_time_iso
-                message = f"Alarma {alarm_id[:8]} ({alarm_type_display}) marcada como Falso Positivo."
-                success = True
-            else:
-                message = f"No se puede '{action}' la alarma {alarm_id[:8]} ({alarm_type_display}) en estado '{alarm_found['status']}'."
-            print(message)
+        return jsonify({
+            "cameras": [camera.stats_dict() for camera in cameras.values()],
+            "stream_clients": sum(camera.frame_hub.subscribers for camera in cameras.values()),
+            "inference": dict(inference_pool.stats) if inference_pool else None,
+            "inference_workers": inference_pool.workers_status() if INFERENCE_USE_PROCESSES and inference_pool else None,
+        })
+
+@app.route('/healthz')
+async def healthz():
+    # Vivacidad: el proceso atiende peticiones, aunque los modelos sigan cargando.
+    return jsonify({
+        "status": "ok",
+        "uptime_sec": round(time.time() - app_started_at, 1),
+        "cameras": {camera.camera_id: camera.pipeline_stats['frames_processed'] for camera in cameras.values()},
+    })
+
+@app.route('/readyz')
+async def readyz():
+    models = model_lifecycle.snapshot()
+    pool = inference_pool
+    # En modo procesos el pool existe antes de que sus workers hayan cargado los modelos.
+    workers = pool.workers_status() if INFERENCE_USE_PROCESSES and pool is not None else None
+    ready = pool is not None and pool.ready
+    body = {
+        "ready": ready,
+        "degraded": ready and (len(model_lifecycle.ready_models()) < len(models)
+                               or any(not worker['ready'] for worker in workers or [])),
+        "models": models,
+        "inference_workers": workers,
+        # Todos los workers han agotado sus reintentos de carga: no estará listo sin intervención.
+        "inference_failed": INFERENCE_USE_PROCESSES and pool is not None and pool.failed,
+        "loading_elapsed_sec": model_lifecycle.elapsed_sec(),
+    }
+    return jsonify(body), 200 if ready else 503
+
+@app.route('/metrics')
+async def metrics_route():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/profiler', methods=['GET', 'POST'])
+async def profiler_route():
+    # POST ?enabled=1|0 activa o detiene el muestreo; GET devuelve las pilas colapsadas acumuladas.
+    if request.method == 'POST':
+        if request.args.get('enabled', '1') in ('1', 'true', 'on'):
+            profiler.start()
         else:
-            message = f"Alarma con ID {alarm_id} no encontrada."
+            profiler.stop()
+        return jsonify({"running": profiler.running, "samples": profiler.samples})
+    return Response(profiler.collapsed(), mimetype='text/plain')
+
+async def send_alarm_evidence(alarm_id, kind):
+    try:
+        alarm_id = str(uuid.UUID(alarm_id))
+    except ValueError:
+        return jsonify({"message": f"ID de alarma no válido: {alarm_id}."}), 400
+    snapshot_path, clip_path = clip_recorder.paths(alarm_id)
+    path = snapshot_path if kind == 'snapshot' else clip_path
+    if not os.path.exists(path):
+        return jsonify({"message": f"No hay {'foto' if kind == 'snapshot' else 'clip'} para la alarma {alarm_id[:8]} (o aún se está grabando)."}), 404
+    if kind == 'snapshot':
+        return await send_file(path, mimetype='image/jpeg')
+    return await send_file(path, mimetype='video/x-msvideo', as_attachment=True,
+                           attachment_filename=f'alarma_{alarm_id[:8]}.avi')
+
+@app.route('/alarms/<alarm_id>/snapshot')
+async def alarm_snapshot(alarm_id):
+    return await send_alarm_evidence(alarm_id, 'snapshot')
+
+@app.route('/alarms/<alarm_id>/clip')
+async def alarm_clip(alarm_id):
+    return await send_alarm_evidence(alarm_id, 'clip')
+
+@app.route('/manage_alarm/<alarm_id>/<action>', methods=['POST'])
+async def manage_alarm_route(alarm_id, action):
+    alarm_found, success = alarm_store.transition(alarm_id, action, datetime.now().isoformat())
+    if alarm_found:
+        alarm_type_display = alarm_found['type'].replace('_', ' ').title()
+
+        if success and action == 'acknowledge':
+            message = f"Alarma {alarm_id[:8]} ({alarm_type_display}) reconocida."
+        elif success and action == 'resolve':
+            message = f"Alarma {alarm_id[:8]} ({alarm_type_display}) resuelta."
+        elif success and action == 'false_positive':
+            message = f"Alarma {alarm_id[:8]} ({alarm_type_display}) marcada como Falso Positivo."
+        else:
+            message = f"No se puede '{action}' la alarma {alarm_id[:8]} ({alarm_type_display}) en estado '{alarm_found['status']}'."
+        print(message)
+    else:
+        message = f"Alarma con ID {alarm_id} no encontrada."
     return jsonify({"message": message, "success": success})
 
+@app.route('/zones/<camera_id>', methods=['GET', 'POST'])
+async def camera_zones(camera_id):
+    if camera_id not in cameras:
+        return jsonify({"message": f"Cámara {camera_id} no encontrada."}), 404
+    if request.method == 'POST':
+        data = await request.get_json(silent=True)
+        try:
+            zones = zone_store.set(camera_id, data.get('zones') if isinstance(data, dict) else None)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        print(f"Zonas de la cámara {camera_id} actualizadas ({len(zones)}).")
+    return jsonify({"camera_id": camera_id, "zones": zone_store.get(camera_id),
+                    "max_zones": ZONES_MAX_PER_CAMERA})
+
+@app.route('/alarms/history')
+async def alarm_history():
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        page_size = min(max(1, int(request.args.get('page_size', 50))), ALARM_HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"message": "Parámetros de paginación no válidos."}), 400
+    query = {
+        'since': request.args.get('since'),
+        'until': request.args.get('until'),
+        'camera_id': request.args.get('camera_id'),
+        'alarm_type': request.args.get('type'),
+        'status': request.args.get('status'),
+    }
+    # La consulta a SQLite se hace fuera del bucle de eventos.
+    alarms, total = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: alarm_store.history(page=page, page_size=page_size, **query))
+    return jsonify({"alarms": alarms, "page": page, "page_size": page_size, "total": total})
+
 if __name__ == '__main__':
-    if not model_person or not classnames_person:
-        print("ADVERTENCIA: Modelo de PERSONAS no cargado. Detección de caídas y presencia no funcionará.")
-    if not model_fire or not classnames_fire:
-        print("ADVERTENCIA: Modelo de FUEGO no cargado. Detección de fuego no funcionará.")
-    
-    if (not model_person or not classnames_person) and (not model_fire or not classnames_fire):
-        print("ERROR CRÍTICO: Ningún modelo pudo ser cargado. La aplicación no se iniciará.")
-    else:
-        video_thread = threading.Thread(target=video_processing, daemon=True)
+    init_runtime()
+    # Los modelos se cargan en segundo plano: cámaras y servidor arrancan ya y /readyz indica cuándo hay detección.
+    model_loader_thread = threading.Thread(target=load_models, daemon=True, name='model-loader')
+    model_loader_thread.start()
+    video_threads = []
+    for camera in cameras.values():
+        video_thread = threading.Thread(target=video_processing, args=(camera,), daemon=True)
         video_thread.start()
-        print("Iniciando servidor Flask en http://127.0.0.1:5001")
-        app.run(host='0.0.0.0', port=5001, debug=True, threaded=True, use_reloader=False)
-        
-        print("Deteniendo procesamiento de vídeo...")
-        stop_processing_flag.set()
+        video_threads.append(video_thread)
+    if PROFILER_ENABLED_AT_START:
+        profiler.start()
+    print(f"Iniciando servidor Quart en http://127.0.0.1:5001 ({len(cameras)} cámaras)")
+    app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=False)
+
+    print("Deteniendo procesamiento de vídeo...")
+    stop_processing_flag.set()
+    for video_thread in video_threads:
         if video_thread.is_alive():
             video_thread.join(timeout=5)
-        print("Aplicación cerrada.")
\ No newline at end of file
+    profiler.stop()
+    model_loader_thread.join(timeout=5)
+    if inference_pool is not None:
+        inference_pool.shutdown()
+    for camera in cameras.values():
+        drain_clip_encoder(camera)
+    clip_recorder.close()
+    alarm_store.close()
+    print("Aplicación cerrada.")
@@ -0,0 +1,245 @@
+import argparse
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+from inference import preprocess_frame
+from tracker import iou_matrix
+
+BACKEND_PYTORCH = 'pytorch'
+BACKEND_ONNX = 'onnx'
+BACKEND_OPENVINO = 'openvino'
+BACKENDS = (BACKEND_PYTORCH, BACKEND_ONNX, BACKEND_OPENVINO)
+
+
+def sample_calibration_frames(video_path, num_frames, width, height):
+    """Toma ``num_frames`` frames repartidos uniformemente por un vídeo grabado."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"No se pudo abrir el vídeo de calibración '{video_path}'")
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or num_frames
+    frames = []
+    for frame_idx in np.linspace(0, max(total_frames - 1, 0), num_frames).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_idx))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(cv2.resize(frame, (width, height)))
+    cap.release()
+    if not frames:
+        raise RuntimeError(f"No se pudieron leer frames de calibración de '{video_path}'")
+    return frames
+
+
+def cached_artifact_path(weights_path, backend, int8, imgsz, cache_dir):
+    stem = os.path.splitext(os.path.basename(weights_path))[0]
+    suffix = '_int8' if int8 else ''
+    name = f"{stem}_{imgsz[0]}x{imgsz[1]}{suffix}"
+    if backend == BACKEND_ONNX:
+        return os.path.join(cache_dir, name + '.onnx')
+    return os.path.join(cache_dir, name + '_openvino_model')
+
+
+class _OnnxCalibrationReader:
+    def __init__(self, input_name, frames):
+        self._batches = iter([{input_name: preprocess_frame(frame).numpy()} for frame in frames])
+
+    def get_next(self):
+        return next(self._batches, None)
+
+
+def _quantize_onnx(fp32_path, int8_path, calibration_frames):
+    import onnxruntime
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    session = onnxruntime.InferenceSession(fp32_path, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    del session
+    quantize_static(fp32_path, int8_path, _OnnxCalibrationReader(input_name, calibration_frames),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+
+def _write_calibration_dataset(calibration_frames, classnames, dataset_dir):
+    images_dir = os.path.join(dataset_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    for idx, frame in enumerate(calibration_frames):
+        cv2.imwrite(os.path.join(images_dir, f'calib_{idx:04d}.jpg'), frame)
+    yaml_path = os.path.join(dataset_dir, 'calibration.yaml')
+    with open(yaml_path, 'w') as f:
+        f.write(f"path: {os.path.abspath(dataset_dir)}\ntrain: images\nval: images\nnames:\n")
+        for idx, name in enumerate(classnames):
+            f.write(f"  {idx}: '{name}'\n")
+    return yaml_path
+
+
+def export_model(weights_path, backend, int8=False, imgsz=(480, 640), cache_dir='model_cache',
+                 calibration_frames=None, classnames=None):
+    """Exporta los pesos al backend pedido y devuelve la ruta del artefacto cacheado en disco."""
+    artifact_path = cached_artifact_path(weights_path, backend, int8, imgsz, cache_dir)
+    if os.path.exists(artifact_path):
+        return artifact_path
+    os.makedirs(cache_dir, exist_ok=True)
+    if int8 and not calibration_frames:
+        raise ValueError("La cuantización INT8 necesita frames de calibración.")
+
+    if backend == BACKEND_ONNX:
+        fp32_path = cached_artifact_path(weights_path, backend, False, imgsz, cache_dir)
+        if not os.path.exists(fp32_path):
+            exported = YOLO(weights_path).export(format='onnx', imgsz=list(imgsz), dynamic=True, simplify=True)
+            shutil.move(exported, fp32_path)
+        if int8:
+            _quantize_onnx(fp32_path, artifact_path, calibration_frames)
+    elif backend == BACKEND_OPENVINO:
+        export_kwargs = {'format': 'openvino', 'imgsz': list(imgsz), 'dynamic': True}
+        if int8:
+            dataset_dir = os.path.join(cache_dir, os.path.basename(artifact_path) + '_calibration')
+            export_kwargs.update(int8=True, data=_write_calibration_dataset(calibration_frames, classnames, dataset_dir),
+                                 fraction=1.0)
+        exported = YOLO(weights_path).export(**export_kwargs)
+        shutil.move(exported, artifact_path)
+    else:
+        raise ValueError(f"Backend de inferencia desconocido: '{backend}'")
+    print(f"Modelo '{weights_path}' exportado a {backend}{' INT8' if int8 else ''}: {artifact_path}")
+    return artifact_path
+
+
+def warmup_model(model, imgsz=(480, 640), runs=3):
+    dummy = torch.zeros((1, 3, imgsz[0], imgsz[1]), dtype=torch.float32)
+    for _ in range(runs):
+        model(dummy, verbose=False)
+
+
+def load_detection_model(weights_path, backend=BACKEND_PYTORCH, int8=False, imgsz=(480, 640),
+                         cache_dir='model_cache', calibration_frames=None, classnames=None, warmup_runs=3,
+                         fallback=True):
+    """Carga un modelo YOLO con el backend pedido; si la exportación falla se usa PyTorch (o se relanza el error sin ``fallback``)."""
+    if backend == BACKEND_PYTORCH:
+        if int8:
+            print(f"ADVERTENCIA: INT8 no está soportado con PyTorch; se ignora para '{weights_path}'.")
+        model = YOLO(weights_path)
+    else:
+        try:
+            model = YOLO(export_model(weights_path, backend, int8, imgsz, cache_dir, calibration_frames, classnames),
+                         task='detect')
+        except Exception as e:
+            if not fallback:
+                raise
+            print(f"Error al preparar '{weights_path}' con {backend}{' INT8' if int8 else ''}: {e}. Se usa PyTorch.")
+            model = YOLO(weights_path)
+    if warmup_runs:
+        warmup_model(model, imgsz, warmup_runs)
+    return model
+
+
+def _detections(results, classnames, target_class):
+    boxes = []
+    for info in results:
+        for box in info.boxes:
+            class_idx = int(box.cls[0])
+            if class_idx < len(classnames) and classnames[class_idx] == target_class:
+                boxes.append([float(v) for v in box.xyxy[0]])
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+
+def _agreement(reference, candidate, iou_threshold=0.5):
+    """Precisión y recall de ``candidate`` tomando como referencia las detecciones de PyTorch."""
+    matched = 0
+    total_reference = 0
+    total_candidate = 0
+    for ref_boxes, cand_boxes in zip(reference, candidate):
+        total_reference += len(ref_boxes)
+        total_candidate += len(cand_boxes)
+        ious = iou_matrix(ref_boxes, cand_boxes)
+        used = set()
+        for ref_idx in range(len(ref_boxes)):
+            for cand_idx in np.argsort(-ious[ref_idx]) if ious.size else []:
+                if ious[ref_idx, cand_idx] < iou_threshold:
+                    break
+                if cand_idx not in used:
+                    used.add(cand_idx)
+                    matched += 1
+                    break
+    precision = matched / total_candidate if total_candidate else 1.0
+    recall = matched / total_reference if total_reference else 1.0
+    return precision, recall
+
+
+def compare_backends(weights_path, classnames, target_class, conf, frames, calibration_frames,
+                     imgsz=(480, 640), cache_dir='model_cache'):
+    """Mide latencia y concordancia con PyTorch de cada combinación backend/precisión."""
+    variants = [(BACKEND_PYTORCH, False), (BACKEND_ONNX, False), (BACKEND_ONNX, True),
+                (BACKEND_OPENVINO, False), (BACKEND_OPENVINO, True)]
+    tensors = [preprocess_frame(frame) for frame in frames]
+    rows = []
+    reference = None
+    for backend, int8 in variants:
+        try:
+            # Sin fallback: una variante que no se puede exportar no debe medirse como si fuera PyTorch.
+            model = load_detection_model(weights_path, backend, int8, imgsz, cache_dir, calibration_frames, classnames,
+                                         fallback=False)
+        except Exception as e:
+            print(f"{backend}{' INT8' if int8 else ''}: no disponible ({e})")
+            rows.append({'backend': backend + (' INT8' if int8 else ''), 'error': f"{type(e).__name__}: {e}"})
+            continue
+        latencies = []
+        detections = []
+        for tensor in tensors:
+            start = time.perf_counter()
+            results = model(tensor, verbose=False, conf=conf)
+            latencies.append((time.perf_counter() - start) * 1000)
+            detections.append(_detections(results, classnames, target_class))
+        if reference is None:
+            reference = detections
+        precision, recall = _agreement(reference, detections)
+        rows.append({
+            'backend': backend + (' INT8' if int8 else ''),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'detections': int(sum(len(d) for d in detections)),
+            'precision_vs_pytorch': precision,
+            'recall_vs_pytorch': recall,
+        })
+    return rows
+
+
+def print_comparison(title, rows):
+    print(f"\n{title}")
+    print(f"{'Backend':<16}{'p50 ms':>9}{'p95 ms':>9}{'Detecc.':>9}{'Prec.':>8}{'Recall':>8}")
+    for row in rows:
+        if 'error' in row:
+            print(f"{row['backend']:<16}  no disponible: {row['error']}")
+            continue
+        print(f"{row['backend']:<16}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['detections']:>9}"
+              f"{row['precision_vs_pytorch']:>8.3f}{row['recall_vs_pytorch']:>8.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara backends de inferencia para los modelos de personas y fuego.")
+    parser.add_argument('video', help="Vídeo grabado para calibración y evaluación")
+    parser.add_argument('--frames', type=int, default=200, help="Frames de evaluación")
+    parser.add_argument('--calibration-frames', type=int, default=100)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--cache-dir', default='model_cache')
+    parser.add_argument('--person-model', default='yolov8s.pt')
+    parser.add_argument('--person-classes', default='classes.txt')
+    parser.add_argument('--person-conf', type=float, default=0.60)
+    parser.add_argument('--fire-model', default='fire_model.pt')
+    parser.add_argument('--fire-classes', default='classes_fire.txt')
+    parser.add_argument('--fire-conf', type=float, default=0.40)
+    args = parser.parse_args()
+
+    imgsz = (args.height, args.width)
+    eval_frames = sample_calibration_frames(args.video, args.frames, args.width, args.height)
+    calib_frames = sample_calibration_frames(args.video, args.calibration_frames, args.width, args.height)
+    for weights, classes_path, target, conf in ((args.person_model, args.person_classes, 'person', args.person_conf),
+                                                 (args.fire_model, args.fire_classes, 'fire', args.fire_conf)):
+        with open(classes_path, 'r') as f:
+            names = f.read().splitlines()
+        comparison = compare_backends(weights, names, target, conf, eval_frames, calib_frames, imgsz, args.cache_dir)
+        print_comparison(f"{weights} (clase '{target}', conf >= {conf})", comparison)
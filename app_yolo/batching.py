@@ -0,0 +1,32 @@
+import math
+import threading
+import time
+
+PRODUCER_IDLE_SEC = 1.0
+
+
+class ActiveProducers:
+    """Cámaras que han enviado frames al pool en el último ``idle_sec`` y lote máximo que pueden formar.
+
+    Cada cámara espera su resultado antes de enviar otro frame, así que un
+    lote nunca puede tener más elementos que cámaras activas: esperar a más
+    (p. ej. con una sola cámara o en el replay) solo añade latencia.
+    """
+
+    def __init__(self, idle_sec=PRODUCER_IDLE_SEC):
+        self.idle_sec = idle_sec
+        self._lock = threading.Lock()
+        self._last_seen = {}
+
+    def touch(self, camera_id):
+        with self._lock:
+            self._last_seen[camera_id] = time.time()
+
+    def count(self):
+        now = time.time()
+        with self._lock:
+            return sum(1 for last_seen in self._last_seen.values() if now - last_seen <= self.idle_sec)
+
+    def expected_batch(self, num_workers, max_batch):
+        """Elementos que cabe esperar por lote si los frames se reparten entre ``num_workers`` workers."""
+        return max(1, min(max_batch, math.ceil(self.count() / max(1, num_workers))))
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ChangeNotifier:
+    """Versión monótona de un estado compartido con espera asíncrona a cambios.
+
+    Los hilos de procesamiento llaman a ``bump`` cuando cambia algo y las
+    corrutinas del servidor esperan con ``wait_for_change`` sin hacer polling.
+    También da los números de secuencia de frames de ``FrameHub``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._async_waiters = set()
+        self.version = 0
+
+    def bump(self):
+        """Incrementa la versión, despierta a quien espera y devuelve la nueva versión."""
+        with self._lock:
+            self.version += 1
+            version = self.version
+            waiters = list(self._async_waiters)
+            self._async_waiters.clear()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return version
+
+    async def wait_for_change(self, last_version, timeout=None):
+        """Espera a que la versión supere ``last_version``; devuelve la versión actual o None si vence el plazo."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.version > last_version:
+                return self.version
+            waiter = (loop, loop.create_future())
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                self._async_waiters.discard(waiter)
+        return self.version
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class ClipRingBuffer:
+    """Últimos frames JPEG de una cámara, acotados a la vez por segundos y por bytes."""
+
+    def __init__(self, max_seconds, max_bytes):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self._frames = deque()
+        self.nbytes = 0
+
+    def append(self, ts, jpeg_bytes):
+        self._frames.append((ts, jpeg_bytes))
+        self.nbytes += len(jpeg_bytes)
+        while len(self._frames) > 1 and (ts - self._frames[0][0] > self.max_seconds or self.nbytes > self.max_bytes):
+            _, old_bytes = self._frames.popleft()
+            self.nbytes -= len(old_bytes)
+
+    def since(self, ts):
+        return [item for item in self._frames if item[0] >= ts]
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class ClipRecorder:
+    """Guarda clips de evidencia (antes y después de cada alarma) y una foto clave por alarma.
+
+    El bucle de procesamiento solo añade referencias a JPEG ya codificados;
+    al dispararse una alarma se congela lo que hay en el buffer, se siguen
+    añadiendo los frames de los ``post_seconds`` siguientes y un hilo escritor
+    vuelca el resultado a disco, de modo que el procesamiento nunca espera a E/S.
+    """
+
+    def __init__(self, output_dir, pre_seconds, post_seconds, max_buffer_bytes, fallback_fps, on_saved=None):
+        self.output_dir = output_dir
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_buffer_bytes = max_buffer_bytes
+        self.fallback_fps = fallback_fps
+        self._on_saved = on_saved
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._pending = {}
+        self._queue = queue.Queue()
+        self.clips_written = 0
+        os.makedirs(output_dir, exist_ok=True)
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True, name='clip-writer')
+        self._writer.start()
+
+    def paths(self, alarm_id):
+        return (os.path.join(self.output_dir, f'{alarm_id}.jpg'),
+                os.path.join(self.output_dir, f'{alarm_id}.avi'))
+
+    def add_frame(self, camera_id, ts, jpeg_bytes):
+        with self._lock:
+            ring = self._buffers.get(camera_id)
+            if ring is None:
+                ring = self._buffers[camera_id] = ClipRingBuffer(self.pre_seconds, self.max_buffer_bytes)
+            ring.append(ts, jpeg_bytes)
+            pending = self._pending.get(camera_id)
+            if not pending:
+                return
+            still_pending = []
+            for capture in pending:
+                capture['frames'].append((ts, jpeg_bytes))
+                if ts >= capture['until']:
+                    self._queue.put(capture)
+                else:
+                    still_pending.append(capture)
+            self._pending[camera_id] = still_pending
+
+    def trigger(self, camera_id, alarm_id, event_ts):
+        """Congela el buffer de la cámara para la alarma; devuelve (ruta de la foto, ruta del clip)."""
+        with self._lock:
+            ring = self._buffers.get(camera_id)
+            frames = ring.since(event_ts - self.pre_seconds) if ring is not None else []
+            self._pending.setdefault(camera_id, []).append({
+                'alarm_id': alarm_id,
+                'event_ts': event_ts,
+                'until': event_ts + self.post_seconds,
+                'frames': frames,
+            })
+        return self.paths(alarm_id)
+
+    def flush(self, camera_id):
+        """Escribe ya las capturas a medio completar de una cámara (p. ej. al detener su procesamiento)."""
+        with self._lock:
+            for capture in self._pending.pop(camera_id, []):
+                self._queue.put(capture)
+
+    def buffer_bytes(self):
+        with self._lock:
+            return {camera_id: ring.nbytes for camera_id, ring in self._buffers.items()}
+
+    def close(self):
+        with self._lock:
+            camera_ids = list(self._pending)
+        for camera_id in camera_ids:
+            self.flush(camera_id)
+        self._queue.put(None)
+        self._writer.join(timeout=30)
+
+    def _writer_loop(self):
+        while True:
+            capture = self._queue.get()
+            if capture is None:
+                break
+            try:
+                self._write_capture(capture)
+            except Exception as e:
+                print(f"Error al guardar el clip de la alarma {capture['alarm_id']}: {e}")
+
+    def _write_capture(self, capture):
+        frames = capture['frames']
+        if not frames:
+            return
+        snapshot_path, clip_path = self.paths(capture['alarm_id'])
+        # La foto clave es el primer frame en o tras el instante de la alarma.
+        key_jpeg = next((jpeg for ts, jpeg in frames if ts >= capture['event_ts']), frames[-1][1])
+        tmp_snapshot_path = snapshot_path + '.part'
+        with open(tmp_snapshot_path, 'wb') as f:
+            f.write(key_jpeg)
+        os.replace(tmp_snapshot_path, snapshot_path)
+
+        span = frames[-1][0] - frames[0][0]
+        fps = (len(frames) - 1) / span if span > 0 else self.fallback_fps
+        first_frame = cv2.imdecode(np.frombuffer(frames[0][1], dtype=np.uint8), cv2.IMREAD_COLOR)
+        height, width = first_frame.shape[:2]
+        # Se escribe con otro nombre y se renombra al final para no servir nunca un clip a medias.
+        tmp_clip_path = clip_path[:-len('.avi')] + '.part.avi'
+        writer = cv2.VideoWriter(tmp_clip_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+        try:
+            for _, jpeg in frames:
+                frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if frame is not None and frame.shape[:2] == (height, width):
+                    writer.write(frame)
+        finally:
+            writer.release()
+        os.replace(tmp_clip_path, clip_path)
+        self.clips_written += 1
+        if self._on_saved is not None:
+            self._on_saved(capture['alarm_id'], snapshot_path, clip_path)
@@ -0,0 +1,38 @@
+import time
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    """Reloj de pared real; es el que usa la aplicación en producción."""
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now()
+
+
+class SimulatedClock:
+    """Reloj controlado desde fuera, para reproducir grabaciones sin depender de la hora real.
+
+    El tiempo solo avanza con ``advance_to``: en modo replay se fija a la marca
+    de tiempo de cada frame, así los temporizadores de alarma ven exactamente
+    el mismo tiempo transcurrido que verían en directo.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self._offset_sec = 0.0
+
+    def advance_to(self, offset_sec):
+        self._offset_sec = offset_sec
+
+    @property
+    def offset_sec(self):
+        return self._offset_sec
+
+    def time(self):
+        return self.start.timestamp() + self._offset_sec
+
+    def now(self):
+        return self.start + timedelta(seconds=self._offset_sec)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import cv2
+
+from change_notifier import ChangeNotifier
+
+
+class FrameHub:
+    """Difunde el último frame anotado de una cámara a todos los clientes conectados.
+
+    El productor publica frames sin codificar con un número de secuencia
+    creciente y los clientes solo se despiertan cuando hay uno nuevo. Un
+    cliente lento no acumula cola: al despertar recibe directamente el frame
+    más reciente. La codificación JPEG se hace bajo demanda, una sola vez por
+    frame y por calidad/resolución (tier), y solo si alguien la pide.
+    """
+
+    def __init__(self, on_encode=None):
+        self._on_encode = on_encode
+        self._lock = threading.Lock()
+        # La versión del notificador es el número de secuencia del último frame publicado.
+        self._changes = ChangeNotifier()
+        self._frame = None
+        self._tier_cache = {}
+        self._tier_locks = {}
+        self.tier_encodes = {}
+        self.subscribers = 0
+
+    def publish(self, frame):
+        with self._lock:
+            self._frame = frame
+            return self._changes.bump()
+
+    def latest(self):
+        with self._lock:
+            return self._changes.version, self._frame
+
+    def add_subscriber(self):
+        with self._lock:
+            self.subscribers += 1
+
+    def remove_subscriber(self):
+        with self._lock:
+            self.subscribers -= 1
+
+    def encode(self, seq, frame, width, quality, exact=False):
+        """Devuelve el JPEG del frame ``seq`` para el tier (width, quality), codificándolo como mucho una vez.
+
+        Para el stream vale cualquier frame igual o más reciente que ``seq``;
+        con ``exact`` (buffer de clips, que puede ir retrasado) solo se reutiliza
+        la caché si es justo ese frame, y un frame antiguo no la sustituye.
+        """
+        key = (width, quality)
+        with self._lock:
+            tier_lock = self._tier_locks.setdefault(key, threading.Lock())
+        with tier_lock:
+            cached = self._tier_cache.get(key)
+            if cached is not None and (cached[0] == seq or (cached[0] > seq and not exact)):
+                return cached[1]
+            start = time.perf_counter()
+            height_src, width_src = frame.shape[:2]
+            if width_src != width:
+                frame = cv2.resize(frame, (width, max(1, round(height_src * width / width_src))),
+                                   interpolation=cv2.INTER_AREA)
+            ret_jpeg, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            frame_bytes = buffer.tobytes() if ret_jpeg else None
+            if cached is None or cached[0] < seq:
+                self._tier_cache[key] = (seq, frame_bytes)
+            self.tier_encodes[key] = self.tier_encodes.get(key, 0) + 1
+            if self._on_encode is not None:
+                self._on_encode(time.perf_counter() - start, f'{width}w_q{quality}')
+            return frame_bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': self.subscribers,
+                'tier_encodes': {f'{width}w_q{quality}': count for (width, quality), count in self.tier_encodes.items()},
+            }
+
+    async def wait_for_frame(self, last_seq, timeout=None):
+        """Espera a un frame con secuencia mayor que ``last_seq``; devuelve (seq, frame) o None."""
+        if await self._changes.wait_for_change(last_seq, timeout) is None:
+            return None
+        return self.latest()
@@ -0,0 +1,243 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+
+from batching import ActiveProducers
+
+MODEL_STRIDE = 32
+LETTERBOX_PAD_VALUE = (114, 114, 114)
+
+
+def preprocess_frame(frame):
+    """Convierte un frame BGR en un tensor BCHW float 0-1 apto para YOLO.
+
+    Solo se rellena por abajo y por la derecha hasta múltiplo del stride, de
+    modo que las coordenadas de las cajas coinciden con las del frame original.
+    """
+    height, width = frame.shape[:2]
+    pad_h = (-height) % MODEL_STRIDE
+    pad_w = (-width) % MODEL_STRIDE
+    if pad_h or pad_w:
+        frame = cv2.copyMakeBorder(frame, 0, pad_h, 0, pad_w, cv2.BORDER_CONSTANT, value=LETTERBOX_PAD_VALUE)
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    chw = np.ascontiguousarray(rgb.transpose(2, 0, 1))
+    return torch.from_numpy(chw).float().div_(255.0).unsqueeze(0)
+
+
+def detections_array(result):
+    """Cajas de un Results de ultralytics como un único array (N, 6): x1, y1, x2, y2, conf, clase."""
+    return result.boxes.data.cpu().numpy().astype(np.float32, copy=False).reshape(-1, 6)
+
+
+def run_grouped_batch(dual, items):
+    """Ejecuta un lote de (tensor, run_person, run_fire, recortes de fuego) y devuelve, por elemento, (detecciones persona, fuego).
+
+    Solo se apilan tensores del mismo tamaño; cada modelo procesa únicamente
+    los elementos que lo necesitan. Un modelo no ejecutado devuelve None. Si
+    un elemento trae recortes (lista de tensores), el modelo de fuego se
+    ejecuta sobre ellos en vez de sobre el frame y devuelve una lista de
+    arrays, uno por recorte; los recortes de todo el lote van en una llamada.
+    """
+    by_shape = {}
+    crops_by_item = {}
+    for item_idx, (tensor, run_person, run_fire, fire_crops) in enumerate(items):
+        if run_person:
+            by_shape.setdefault(tuple(tensor.shape), ([], []))[0].append((item_idx, tensor))
+        if run_fire and fire_crops is None:
+            by_shape.setdefault(tuple(tensor.shape), ([], []))[1].append(((item_idx, None), tensor))
+        elif run_fire:
+            crops_by_item[item_idx] = [None] * len(fire_crops)
+            for crop_idx, crop in enumerate(fire_crops):
+                by_shape.setdefault(tuple(crop.shape), ([], []))[1].append(((item_idx, crop_idx), crop))
+
+    # Primero se lanzan todas las llamadas y después se recogen: así el modelo de personas (frames) y el
+    # de fuego (recortes de otro tamaño) se ejecutan a la vez aunque estén en grupos distintos.
+    pending = [(person_inputs, fire_inputs, dual.submit_batch(
+        torch.cat([tensor for _, tensor in person_inputs]) if person_inputs else None,
+        torch.cat([tensor for _, tensor in fire_inputs]) if fire_inputs else None))
+        for person_inputs, fire_inputs in by_shape.values()]
+    person_by_item = {}
+    fire_by_item = {}
+    for person_inputs, fire_inputs, (future_person, future_fire) in pending:
+        results_person = future_person.result() if future_person is not None else None
+        results_fire = future_fire.result() if future_fire is not None else None
+        if results_person is not None:
+            for (item_idx, _), result in zip(person_inputs, results_person):
+                person_by_item[item_idx] = detections_array(result)
+        if results_fire is not None:
+            for ((item_idx, crop_idx), _), result in zip(fire_inputs, results_fire):
+                if crop_idx is None:
+                    fire_by_item[item_idx] = detections_array(result)
+                else:
+                    crops_by_item[item_idx][crop_idx] = detections_array(result)
+    for item_idx, crop_outputs in crops_by_item.items():
+        # Sin modelo de fuego los recortes quedan sin resultado: se devuelve None como para un frame.
+        if all(output is not None for output in crop_outputs):
+            fire_by_item[item_idx] = crop_outputs
+    return [(person_by_item.get(item_idx), fire_by_item.get(item_idx)) for item_idx in range(len(items))]
+
+
+class DualModelInference:
+    """Ejecuta los modelos de personas y fuego en paralelo sobre un único preprocesado.
+
+    Cada modelo tiene su propio hilo: las llamadas a un mismo modelo se
+    ejecutan en orden (YOLO no es seguro entre hilos) y las de modelos
+    distintos, a la vez.
+    """
+
+    def __init__(self, model_person, model_fire, conf_person, conf_fire, threads_per_model=None, on_timing=None,
+                 classes_person=None, classes_fire=None):
+        self.model_person = model_person
+        self.model_fire = model_fire
+        self.conf_person = conf_person
+        self.conf_fire = conf_fire
+        # Limitar las clases en el propio modelo descarta el resto antes del NMS.
+        self.classes_person = classes_person
+        self.classes_fire = classes_fire
+        if threads_per_model is None:
+            threads_per_model = max(1, (os.cpu_count() or 2) // 2)
+        self.threads_per_model = threads_per_model
+        self._on_timing = on_timing
+        self._executor_person = ThreadPoolExecutor(max_workers=1, thread_name_prefix='yolo-person',
+                                                   initializer=torch.set_num_threads,
+                                                   initargs=(threads_per_model,))
+        self._executor_fire = ThreadPoolExecutor(max_workers=1, thread_name_prefix='yolo-fire',
+                                                 initializer=torch.set_num_threads,
+                                                 initargs=(threads_per_model,))
+
+    def submit_batch(self, tensor_person, tensor_fire):
+        """Lanza cada modelo sobre su lote BCHW (o no, si es None); devuelve un futuro (o None) por modelo."""
+        future_person = None
+        future_fire = None
+        if self.model_person is not None and tensor_person is not None:
+            future_person = self._executor_person.submit(self._predict, 'person', self.model_person, tensor_person,
+                                                         self.conf_person, self.classes_person)
+        if self.model_fire is not None and tensor_fire is not None:
+            future_fire = self._executor_fire.submit(self._predict, 'fire', self.model_fire, tensor_fire,
+                                                     self.conf_fire, self.classes_fire)
+        return future_person, future_fire
+
+    def _predict(self, model_name, model, tensor, conf, classes):
+        start = time.perf_counter()
+        results = model(tensor, verbose=False, conf=conf, classes=classes)
+        if self._on_timing is not None:
+            self._on_timing(model_name, time.perf_counter() - start, tensor.shape[0])
+        return results
+
+    def shutdown(self):
+        self._executor_person.shutdown(wait=False)
+        self._executor_fire.shutdown(wait=False)
+
+
+class InferencePool:
+    """Pool compartido de workers YOLO que agrupa en lotes los frames de todas las cámaras.
+
+    Devuelve las detecciones de cada frame como arrays (N, 6) (ver
+    ``detections_array``), igual que ``ProcessInferencePool``. Cada worker tiene su propia copia de los modelos (las instancias de YOLO no
+    son seguras entre hilos), así que el número de copias depende del número de
+    workers y no del número de cámaras.
+    """
+
+    def __init__(self, model_factory, conf_person, conf_fire, num_workers=1, max_batch=8,
+                 batch_wait_sec=0.01, initial_models=None, on_timing=None, classes_person=None, classes_fire=None):
+        self.conf_person = conf_person
+        self.conf_fire = conf_fire
+        self.classes_person = classes_person
+        self.classes_fire = classes_fire
+        self.max_batch = max(1, max_batch)
+        self.batch_wait_sec = batch_wait_sec
+        self._model_factory = model_factory
+        self._initial_models = initial_models
+        self._on_timing = on_timing
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._threads_per_model = max(1, (os.cpu_count() or 2) // (2 * max(1, num_workers)))
+        self.stats = {'batches': 0, 'frames': 0, 'max_batch_seen': 0, 'failed_requests': 0}
+        self._stats_lock = threading.Lock()
+        self._producers = ActiveProducers()
+        self._workers = []
+        for worker_idx in range(max(1, num_workers)):
+            worker = threading.Thread(target=self._worker_loop, args=(worker_idx,), daemon=True,
+                                      name=f'inference-worker-{worker_idx}')
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def ready(self):
+        # El worker 0 arranca con los modelos ya cargados en el proceso principal.
+        return True
+
+    def submit(self, camera_id, frame, run_person=True, run_fire=True, fire_crops=None):
+        """Encola un frame; con ``fire_crops`` (imágenes del mismo tamaño) el modelo de fuego se ejecuta solo sobre ellas."""
+        future = Future()
+        crop_tensors = [preprocess_frame(crop) for crop in fire_crops] if fire_crops is not None else None
+        self._producers.touch(camera_id)
+        self._queue.put((camera_id, preprocess_frame(frame), future, run_person, run_fire, crop_tensors))
+        return future
+
+    def infer(self, camera_id, frame, run_person=True, run_fire=True, fire_crops=None):
+        if not run_person and not run_fire:
+            return None, None
+        return self.submit(camera_id, frame, run_person, run_fire, fire_crops).result()
+
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        # Solo se espera a frames que pueden llegar: como mucho uno por cámara activa.
+        expected = self._producers.expected_batch(len(self._workers), self.max_batch)
+        deadline = time.time() + self.batch_wait_sec
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time() if len(batch) < expected else 0
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker_loop(self, worker_idx):
+        torch.set_num_threads(self._threads_per_model)
+        if worker_idx == 0 and self._initial_models is not None:
+            model_person, model_fire = self._initial_models
+        else:
+            try:
+                model_person, model_fire = self._model_factory()
+            except Exception as e:
+                print(f"Error al cargar los modelos del worker de inferencia {worker_idx}: {e}")
+                return
+        dual = DualModelInference(model_person, model_fire, self.conf_person, self.conf_fire,
+                                  threads_per_model=self._threads_per_model, on_timing=self._on_timing,
+                                  classes_person=self.classes_person, classes_fire=self.classes_fire)
+
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            try:
+                outputs = run_grouped_batch(dual, [(item[1], item[3], item[4], item[5]) for item in batch])
+            except Exception as e:
+                # Igual que ProcessInferencePool: el frame sigue sin detecciones y la cámara no se detiene.
+                print(f"Error de inferencia en el worker {worker_idx}: {e}")
+                with self._stats_lock:
+                    self.stats['failed_requests'] += len(batch)
+                for item in batch:
+                    item[2].set_result((None, None))
+                continue
+            for item, output in zip(batch, outputs):
+                item[2].set_result(output)
+            with self._stats_lock:
+                self.stats['batches'] += 1
+                self.stats['frames'] += len(batch)
+                self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(batch))
+        dual.shutdown()
+
+    def shutdown(self):
+        self._stop.set()
@@ -0,0 +1,203 @@
+import bisect
+import sys
+import threading
+import time
+from collections import Counter as _TallyCounter
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels.keys(), escaped)) + '}'
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._callback = callback
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+
+    def _samples(self):
+        # Con callback los valores se leen en el momento del scrape en lugar de mantenerse aquí.
+        if self._callback is not None:
+            return [(self._key(labels), value) for labels, value in self._callback()]
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        return self.header() + [f'{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}'
+                                for key, value in self._samples()]
+
+
+class CounterMetric(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class GaugeMetric(_Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class HistogramMetric(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        bucket_idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bucket_idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: ([*state[0]], state[1], state[2]) for key, state in self._values.items()}
+        lines = self.header()
+        for key, (bucket_counts, total, count) in values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+                lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": le})} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self._register(CounterMetric(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(GaugeMetric(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(HistogramMetric(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedLock:
+    """``threading.Lock`` que mide el tiempo de espera y de posesión en dos histogramas."""
+
+    def __init__(self, wait_histogram, hold_histogram, name):
+        self._lock = threading.Lock()
+        self._wait_histogram = wait_histogram
+        self._hold_histogram = hold_histogram
+        self._name = name
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            self._wait_histogram.observe(self._acquired_at - start, lock=self._name)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        self._hold_histogram.observe(held, lock=self._name)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SamplingProfiler:
+    """Profiler de muestreo de todos los hilos, en formato de pilas colapsadas (flamegraph)."""
+
+    def __init__(self, interval_sec=0.01, max_depth=40):
+        self.interval_sec = interval_sec
+        self.max_depth = max_depth
+        self._stacks = _TallyCounter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.samples = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='sampling-profiler')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval_sec):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+                    frame = frame.f_back
+                sampled.append(';'.join([thread_names.get(ident, str(ident))] + stack[::-1]))
+            with self._lock:
+                self._stacks.update(sampled)
+                self.samples += 1
+
+    def collapsed(self):
+        with self._lock:
+            return '\n'.join(f'{stack} {count}' for stack, count in self._stacks.most_common()) + '\n'
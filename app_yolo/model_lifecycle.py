@@ -0,0 +1,63 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MODEL_PENDING = 'pending'
+MODEL_LOADING = 'loading'
+MODEL_WARMING_UP = 'warming_up'
+MODEL_READY = 'ready'
+MODEL_FAILED = 'failed'
+
+
+class ModelLifecycle:
+    """Estado de carga de cada modelo (pendiente, cargando, calentando, listo o fallido) y su tiempo de carga.
+
+    ``load_all`` carga todos los modelos en paralelo; mientras tanto el
+    servidor ya atiende peticiones y ``/readyz`` informa del progreso.
+    """
+
+    def __init__(self, model_names):
+        self._lock = threading.Lock()
+        self._models = {name: {'state': MODEL_PENDING, 'load_time_sec': None, 'error': None}
+                        for name in model_names}
+        self._started_at = None
+
+    def set_state(self, name, state):
+        with self._lock:
+            self._models[name]['state'] = state
+
+    def load_all(self, loaders):
+        """Ejecuta en paralelo ``loaders`` ({nombre: función}) y devuelve {nombre: resultado o None si falla}."""
+        self._started_at = time.time()
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(loaders)), thread_name_prefix='model-loader') as executor:
+            futures = {name: executor.submit(self._load_one, name, loader) for name, loader in loaders.items()}
+            for name, future in futures.items():
+                results[name] = future.result()
+        return results
+
+    def _load_one(self, name, loader):
+        start = time.time()
+        self.set_state(name, MODEL_LOADING)
+        try:
+            result = loader()
+        except Exception as e:
+            with self._lock:
+                self._models[name].update(state=MODEL_FAILED, error=f"{type(e).__name__}: {e}",
+                                          load_time_sec=round(time.time() - start, 3))
+            print(f"Error al cargar el modelo '{name}': {e}")
+            return None
+        with self._lock:
+            self._models[name].update(state=MODEL_READY, load_time_sec=round(time.time() - start, 3))
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(info) for name, info in self._models.items()}
+
+    def ready_models(self):
+        with self._lock:
+            return [name for name, info in self._models.items() if info['state'] == MODEL_READY]
+
+    def elapsed_sec(self):
+        return round(time.time() - self._started_at, 3) if self._started_at is not None else None
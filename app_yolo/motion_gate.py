@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Prefiltro barato que decide qué modelos YOLO hace falta ejecutar en cada frame.
+
+    Compara una versión reducida en escala de grises con un fondo de media móvil.
+    Si la escena no cambia se reutilizan las últimas detecciones, pero cada modelo
+    se vuelve a ejecutar como mínimo cada ``max_skip_sec`` segundos.
+    """
+
+    def __init__(self, downscale_width=160, pixel_diff_threshold=25, min_changed_ratio=0.005,
+                 background_alpha=0.05, max_skip_sec_person=2.0, max_skip_sec_fire=0.5):
+        self.downscale_width = downscale_width
+        self.pixel_diff_threshold = pixel_diff_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.background_alpha = background_alpha
+        self.max_skip_sec = {'person': max_skip_sec_person, 'fire': max_skip_sec_fire}
+        self._background = None
+        self._last_run = {'person': None, 'fire': None}
+        self.last_changed_ratio = 0.0
+        self.stats = {'frames': 0, 'person_runs': 0, 'fire_runs': 0}
+
+    def _changed_ratio(self, frame):
+        height, width = frame.shape[:2]
+        small_height = max(1, int(height * self.downscale_width / width))
+        small = cv2.resize(frame, (self.downscale_width, small_height), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0).astype(np.float32)
+        if self._background is None:
+            self._background = gray
+            return 1.0
+        diff = cv2.absdiff(gray, self._background)
+        cv2.accumulateWeighted(gray, self._background, self.background_alpha)
+        return float(np.count_nonzero(diff > self.pixel_diff_threshold)) / diff.size
+
+    def _should_run(self, model, scene_changed, now, force):
+        last_run = self._last_run[model]
+        return force or scene_changed or last_run is None or now - last_run >= self.max_skip_sec[model]
+
+    def mark_run(self, model, now):
+        self._last_run[model] = now
+        self.stats[f'{model}_runs'] += 1
+
+    def decide(self, frame, now, force_person=False, force_fire=False):
+        """Devuelve (run_person, run_fire). Quien llama debe usar ``mark_run`` para los modelos que ejecute."""
+        self.stats['frames'] += 1
+        self.last_changed_ratio = self._changed_ratio(frame)
+        scene_changed = self.last_changed_ratio >= self.min_changed_ratio
+        run_person = self._should_run('person', scene_changed, now, force_person)
+        run_fire = self._should_run('fire', scene_changed, now, force_fire)
+        return run_person, run_fire
+
+    def to_dict(self):
+        frames = self.stats['frames']
+        return {
+            'frames': frames,
+            'person_runs': self.stats['person_runs'],
+            'fire_runs': self.stats['fire_runs'],
+            'person_skip_ratio': round(1 - self.stats['person_runs'] / frames, 3) if frames else 0.0,
+            'fire_skip_ratio': round(1 - self.stats['fire_runs'] / frames, 3) if frames else 0.0,
+            'last_changed_ratio': round(self.last_changed_ratio, 4),
+        }
@@ -0,0 +1,389 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from batching import ActiveProducers
+
+WORKER_POLL_INTERVAL_SEC = 0.5
+WORKER_RESTART_DELAY_SEC = 2.0
+# Un worker que muere sin haber llegado a cargar los modelos (p. ej. un error de configuración) se
+# reintenta con espera exponencial, hasta WORKER_RESTART_MAX_DELAY_SEC, y tras WORKER_MAX_LOAD_FAILURES
+# fallos seguidos deja de relanzarse: cada intento vuelve a importar torch y a cargar los modelos.
+WORKER_RESTART_MAX_DELAY_SEC = 60.0
+WORKER_MAX_LOAD_FAILURES = 5
+
+
+class SharedFrameRing:
+    """Huecos de tamaño fijo en un bloque de memoria compartida para pasar frames entre procesos sin serializarlos."""
+
+    def __init__(self, num_slots, slot_bytes, name=None):
+        self.num_slots = num_slots
+        self.slot_bytes = slot_bytes
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=num_slots * slot_bytes)
+            self._owner = True
+        else:
+            # Los hijos lanzados con 'spawn' comparten el resource tracker del padre: el registro que hace
+            # SharedMemory al adjuntar es el mismo del padre, así que no se debe desregistrar aquí.
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def view(self, slot, shape, offset=0):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf, offset=slot * self.slot_bytes + offset)
+
+    def views(self, slot, shapes):
+        arrays = []
+        offset = 0
+        for shape in shapes:
+            arrays.append(self.view(slot, shape, offset))
+            offset += int(np.prod(shape))
+        return arrays
+
+    def write(self, slot, arrays):
+        """Copia los arrays uno tras otro en el hueco y devuelve sus formas (para leerlos con ``views``)."""
+        total_bytes = sum(array.nbytes for array in arrays)
+        if total_bytes > self.slot_bytes:
+            raise ValueError(f"Los datos ({total_bytes} bytes) no caben en un hueco de {self.slot_bytes} bytes")
+        offset = 0
+        for array in arrays:
+            self.view(slot, array.shape, offset)[...] = array
+            offset += array.nbytes
+        return [array.shape for array in arrays]
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _collect_requests(request_queue, max_batch, batch_wait_sec):
+    first = request_queue.get()
+    if first is None:
+        return None
+    batch = [first]
+    # Cada petición trae cuántas cabe esperar en un lote (ver ActiveProducers); no se espera a más.
+    expected = first[-1]
+    deadline = time.time() + batch_wait_sec
+    while len(batch) < max_batch:
+        remaining = deadline - time.time() if len(batch) < expected else 0
+        try:
+            item = request_queue.get(timeout=remaining) if remaining > 0 else request_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is None:
+            request_queue.put(None)
+            break
+        batch.append(item)
+    return batch
+
+
+def _worker_main(worker_idx, ring_name, num_slots, slot_bytes, request_queue, result_queue, person_spec, fire_spec,
+                 conf_person, conf_fire, classes_person, classes_fire, threads, max_batch, batch_wait_sec):
+    # Los módulos pesados se importan aquí, en el proceso worker.
+    import torch
+    from backends import load_detection_model
+    from inference import DualModelInference, preprocess_frame, run_grouped_batch
+
+    torch.set_num_threads(threads)
+    ring = SharedFrameRing(num_slots, slot_bytes, name=ring_name)
+    try:
+        model_person = load_detection_model(**person_spec) if person_spec else None
+        model_fire = load_detection_model(**fire_spec) if fire_spec else None
+    except Exception as e:
+        result_queue.put(('error', worker_idx, None, f"{type(e).__name__}: {e}"))
+        ring.close()
+        return
+    dual = DualModelInference(model_person, model_fire, conf_person, conf_fire, threads_per_model=threads,
+                              on_timing=lambda model_name, seconds, batch_size: result_queue.put(
+                                  ('timing', worker_idx, None, (model_name, seconds, batch_size))),
+                              classes_person=classes_person, classes_fire=classes_fire)
+    result_queue.put(('ready', worker_idx, None, os.getpid()))
+
+    while True:
+        batch = _collect_requests(request_queue, max_batch, batch_wait_sec)
+        if batch is None:
+            break
+        # El padre no reutiliza un hueco hasta recibir su respuesta: se puede leer sin copiarlo antes.
+        items = []
+        for _, slot, shapes, run_person, run_fire, has_crops, _ in batch:
+            frame, *crops = ring.views(slot, shapes)
+            items.append((preprocess_frame(frame), run_person, run_fire,
+                          [preprocess_frame(crop) for crop in crops] if has_crops else None))
+        try:
+            outputs = run_grouped_batch(dual, items)
+        except Exception as e:
+            for request_id, *_ in batch:
+                result_queue.put(('failed', worker_idx, request_id, f"{type(e).__name__}: {e}"))
+            continue
+        for (request_id, *_), output in zip(batch, outputs):
+            result_queue.put(('result', worker_idx, request_id, output))
+        result_queue.put(('batch', worker_idx, None, len(batch)))
+    dual.shutdown()
+    ring.close()
+
+
+class _WorkerHandle:
+    def __init__(self, worker_idx, slots):
+        self.worker_idx = worker_idx
+        self.slots = slots
+        self.free_slots = queue.Queue()
+        for slot in slots:
+            self.free_slots.put(slot)
+        self.process = None
+        self.request_queue = None
+        self.in_flight = {}
+        self.ready = False
+        self.restarting = False
+        self.restarts = 0
+        self.last_error = None
+        self.load_failures = 0
+        self.stopped = False
+        self.next_restart_at = None
+
+
+class ProcessInferencePool:
+    """Pool de procesos YOLO supervisados, con la misma interfaz que ``InferencePool``.
+
+    Cada worker carga sus propios modelos en un proceso aparte, así la
+    inferencia no compite por el GIL con el servidor ni con el dibujado. Los
+    frames (y sus recortes de zona, a continuación en el mismo hueco) viajan
+    por huecos de memoria compartida y solo las detecciones (arrays (N, 6))
+    vuelven serializadas. Si un worker muere, sus peticiones
+    en curso se responden sin detecciones y el proceso se relanza (con
+    espera creciente y un límite si ni siquiera llega a cargar los modelos).
+    """
+
+    def __init__(self, person_spec, fire_spec, conf_person, conf_fire, frame_shape, num_workers=2,
+                 slots_per_worker=4, max_batch=8, batch_wait_sec=0.01, on_timing=None, classes_person=None,
+                 classes_fire=None, crop_shape=None, max_crops_per_frame=0):
+        self.person_spec = person_spec
+        self.fire_spec = fire_spec
+        self.conf_person = conf_person
+        self.conf_fire = conf_fire
+        self.classes_person = classes_person
+        self.classes_fire = classes_fire
+        self.max_batch = max(1, max_batch)
+        self.batch_wait_sec = batch_wait_sec
+        self._on_timing = on_timing
+        num_workers = max(1, num_workers)
+        slots_per_worker = max(1, slots_per_worker)
+        self._threads_per_worker = max(1, (os.cpu_count() or 2) // num_workers)
+        slot_bytes = int(np.prod(frame_shape))
+        if crop_shape is not None:
+            slot_bytes += max_crops_per_frame * int(np.prod(crop_shape))
+        self._ring = SharedFrameRing(num_workers * slots_per_worker, slot_bytes)
+        self._context = multiprocessing.get_context('spawn')
+        self._result_queue = self._context.Queue()
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._stop = threading.Event()
+        self.stats = {'batches': 0, 'frames': 0, 'max_batch_seen': 0, 'restarts': 0, 'failed_requests': 0}
+        self._producers = ActiveProducers()
+        self._workers = [_WorkerHandle(worker_idx, range(worker_idx * slots_per_worker,
+                                                         (worker_idx + 1) * slots_per_worker))
+                         for worker_idx in range(num_workers)]
+        for worker in self._workers:
+            self._start_worker(worker)
+        self._collector = threading.Thread(target=self._collector_loop, daemon=True, name='inference-supervisor')
+        self._collector.start()
+
+    def _start_worker(self, worker):
+        with self._lock:
+            worker.request_queue = self._context.Queue()
+            worker.ready = False
+        worker.process = self._context.Process(
+            target=_worker_main, daemon=True, name=f'inference-process-{worker.worker_idx}',
+            args=(worker.worker_idx, self._ring.name, self._ring.num_slots, self._ring.slot_bytes,
+                  worker.request_queue, self._result_queue, self.person_spec, self.fire_spec,
+                  self.conf_person, self.conf_fire, self.classes_person, self.classes_fire,
+                  self._threads_per_worker, self.max_batch, self.batch_wait_sec))
+        # Con 'spawn' el hijo importa el script principal como __mp_main__: debe poder importarse sin
+        # efectos (app.py los deja en init_runtime()).
+        worker.process.start()
+
+    def submit(self, camera_id, frame, run_person=True, run_fire=True, fire_crops=None):
+        future = Future()
+        self._producers.touch(camera_id)
+        with self._lock:
+            num_ready = sum(1 for w in self._workers if w.ready)
+            # Un worker caído o arrancando solo recibe frames si no hay ninguno listo.
+            candidates = ([w for w in self._workers if w.ready]
+                          or [w for w in self._workers if not w.restarting and not w.stopped]
+                          or [w for w in self._workers if not w.stopped])
+            if not candidates:
+                # Ningún worker puede cargar los modelos: el frame sigue sin detecciones.
+                self.stats['failed_requests'] += 1
+                future.set_result((None, None))
+                return future
+            worker = min(candidates, key=lambda w: len(w.in_flight))
+        # Si todos los huecos del worker están ocupados se espera: limita la memoria y aplica contrapresión.
+        slot = worker.free_slots.get()
+        try:
+            shapes = self._ring.write(slot, [frame] + list(fire_crops or []))
+        except ValueError:
+            worker.free_slots.put(slot)
+            raise
+        request_id = next(self._request_ids)
+        with self._lock:
+            stopped = worker.stopped
+            if stopped:
+                self.stats['failed_requests'] += 1
+            else:
+                request_queue = worker.request_queue
+                worker.in_flight[request_id] = (future, slot, request_queue)
+        if stopped:
+            worker.free_slots.put(slot)
+            future.set_result((None, None))
+            return future
+        expected = self._producers.expected_batch(num_ready, self.max_batch)
+        request_queue.put((request_id, slot, shapes, run_person, run_fire, fire_crops is not None, expected))
+        return future
+
+    def infer(self, camera_id, frame, run_person=True, run_fire=True, fire_crops=None):
+        if not run_person and not run_fire:
+            return None, None
+        return self.submit(camera_id, frame, run_person, run_fire, fire_crops).result()
+
+    def _complete(self, worker, request_id, output):
+        with self._lock:
+            entry = worker.in_flight.pop(request_id, None)
+        if entry is None:
+            return
+        future, slot, _ = entry
+        worker.free_slots.put(slot)
+        future.set_result(output)
+
+    def _fail_in_flight(self, worker, request_queue=None):
+        """Responde sin detecciones las peticiones en curso (solo las enviadas a ``request_queue`` si se indica)."""
+        with self._lock:
+            failed = {request_id: entry for request_id, entry in worker.in_flight.items()
+                      if request_queue is None or entry[2] is request_queue}
+            for request_id in failed:
+                del worker.in_flight[request_id]
+            self.stats['failed_requests'] += len(failed)
+        # El pipeline sigue sin detecciones en esos frames en lugar de bloquearse o lanzar una excepción.
+        for future, slot, _ in failed.values():
+            worker.free_slots.put(slot)
+            future.set_result((None, None))
+
+    def _handle_message(self, message):
+        kind, worker_idx, request_id, payload = message
+        worker = self._workers[worker_idx]
+        if kind == 'result':
+            self._complete(worker, request_id, payload)
+        elif kind == 'batch':
+            with self._lock:
+                self.stats['batches'] += 1
+                self.stats['frames'] += payload
+                self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], payload)
+        elif kind == 'timing':
+            model_name, seconds, batch_size = payload
+            if self._on_timing is not None:
+                self._on_timing(model_name, seconds, batch_size)
+        elif kind == 'failed':
+            print(f"Error de inferencia en el worker {worker_idx}: {payload}")
+            self._complete(worker, request_id, (None, None))
+        elif kind == 'ready':
+            worker.ready = True
+            worker.last_error = None
+            worker.load_failures = 0
+            print(f"Worker de inferencia {worker_idx} listo (pid {payload}).")
+        elif kind == 'error':
+            worker.last_error = payload
+            print(f"Error al cargar los modelos del worker de inferencia {worker_idx}: {payload}")
+
+    def _supervise(self):
+        for worker in self._workers:
+            if worker.restarting or worker.stopped or worker.process.is_alive() or self._stop.is_set():
+                continue
+            with self._lock:
+                if not worker.ready:
+                    worker.load_failures += 1
+                worker.ready = False
+                worker.stopped = worker.load_failures >= WORKER_MAX_LOAD_FAILURES
+                worker.restarting = not worker.stopped
+            dead_queue = worker.request_queue
+            self._fail_in_flight(worker, dead_queue)
+            if worker.stopped:
+                print(f"Worker de inferencia {worker.worker_idx} terminado (código {worker.process.exitcode}) "
+                      f"sin cargar los modelos {worker.load_failures} veces seguidas. No se reinicia más.")
+                continue
+            delay = min(WORKER_RESTART_DELAY_SEC * 2 ** worker.load_failures, WORKER_RESTART_MAX_DELAY_SEC)
+            worker.next_restart_at = time.time() + delay
+            print(f"Worker de inferencia {worker.worker_idx} terminado (código {worker.process.exitcode}). "
+                  f"Reiniciando en {delay:.0f}s...")
+            # La espera va en un temporizador: el colector sigue entregando los resultados de los demás workers.
+            timer = threading.Timer(delay, self._restart_worker, args=(worker, dead_queue))
+            timer.daemon = True
+            timer.start()
+
+    def _restart_worker(self, worker, dead_queue):
+        if self._stop.is_set():
+            return
+        worker.restarts += 1
+        worker.next_restart_at = None
+        with self._lock:
+            self.stats['restarts'] += 1
+        self._start_worker(worker)
+        with self._lock:
+            worker.restarting = False
+        # Lo que se encoló en la cola del proceso muerto durante la espera ya no lo atenderá nadie.
+        self._fail_in_flight(worker, dead_queue)
+
+    def _collector_loop(self):
+        last_check = time.time()
+        while not self._stop.is_set():
+            try:
+                self._handle_message(self._result_queue.get(timeout=WORKER_POLL_INTERVAL_SEC))
+            except queue.Empty:
+                pass
+            except (EOFError, OSError):
+                if self._stop.is_set():
+                    break
+            if time.time() - last_check >= WORKER_POLL_INTERVAL_SEC:
+                last_check = time.time()
+                self._supervise()
+
+    def workers_status(self):
+        with self._lock:
+            now = time.time()
+            return [{'worker': worker.worker_idx, 'pid': worker.process.pid, 'alive': worker.process.is_alive(),
+                     'ready': worker.ready, 'in_flight': len(worker.in_flight), 'restarts': worker.restarts,
+                     'last_error': worker.last_error, 'load_failures': worker.load_failures,
+                     'stopped': worker.stopped,
+                     'next_restart_in_sec': (round(max(worker.next_restart_at - now, 0.0), 1)
+                                             if worker.next_restart_at is not None else None)}
+                    for worker in self._workers]
+
+    @property
+    def failed(self):
+        """Ningún worker puede cargar los modelos y ya no se reintentan."""
+        return all(worker.stopped for worker in self._workers)
+
+    @property
+    def ready(self):
+        """Hay al menos un worker con los modelos cargados."""
+        return any(worker.ready for worker in self._workers)
+
+    def shutdown(self):
+        self._stop.set()
+        for worker in self._workers:
+            worker.request_queue.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            self._fail_in_flight(worker)
+        self._collector.join(timeout=2)
+        self._ring.close()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import app
+from alarm_store import AlarmStore
+from clip_recorder import ClipRecorder
+from clock import SimulatedClock
+from zones import ZoneStore
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+DEFAULT_REPLAY_START = '2024-01-01T12:00:00'
+DEFAULT_FPS_TOLERANCE = 0.15
+DEFAULT_LATENCY_TOLERANCE = 0.25
+DEFAULT_RSS_TOLERANCE = 0.20
+DEFAULT_TIMELINE_TOLERANCE_SEC = 0.0
+POOL_READY_TIMEOUT_SEC = 300.0
+
+
+class StageRecorder:
+    """Sustituye al histograma de etapas guardando cada muestra, para poder calcular percentiles exactos."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def observe(self, value, camera=None, stage=None):
+        self.samples.setdefault(stage, []).append(value)
+
+    def summary(self):
+        return {stage: {'p50_ms': round(float(np.percentile(values, 50)) * 1000, 3),
+                        'p99_ms': round(float(np.percentile(values, 99)) * 1000, 3),
+                        'count': len(values)}
+                for stage, values in sorted(self.samples.items())}
+
+
+def iter_source_frames(source, fps=None):
+    """Genera (segundos desde el inicio, frame) de un vídeo o de un directorio de imágenes ordenadas por nombre."""
+    if os.path.isdir(source):
+        frame_interval = 1.0 / (fps or 25.0)
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        for frame_idx, name in enumerate(names):
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                yield frame_idx * frame_interval, frame
+        return
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise RuntimeError(f"No se pudo abrir el vídeo '{source}'")
+    # Las marcas de tiempo salen del índice de frame para que sean idénticas en cada ejecución.
+    frame_interval = 1.0 / (fps or cap.get(cv2.CAP_PROP_FPS) or 25.0)
+    frame_idx = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame_idx * frame_interval, frame
+            frame_idx += 1
+    finally:
+        cap.release()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux devuelve KiB y macOS bytes.
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def run_replay(source, start, fps=None, max_frames=None, camera_id='replay'):
+    """Procesa la grabación con el pipeline de la aplicación, sin servidor ni hilo de captura, lo más rápido posible."""
+    if app.inference_pool is None:
+        app.load_models()
+    # Con workers en procesos los modelos terminan de cargarse después: no se mide nada hasta que estén listos.
+    deadline = time.time() + POOL_READY_TIMEOUT_SEC
+    while app.inference_pool is not None and not app.inference_pool.ready and time.time() < deadline:
+        time.sleep(0.1)
+    if app.ready_inference_pool() is None:
+        print("ADVERTENCIA: Pool de inferencia no disponible; el replay se ejecuta sin detección.")
+    clock = SimulatedClock(start)
+    camera = app.CameraState(camera_id, source, clock=clock)
+    recorder = StageRecorder()
+    app.frame_stage_seconds = recorder
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Almacén y clips desechables: el replay no debe tocar las alarmas reales ni verse afectado por ellas.
+        # Las zonas sí se leen de la configuración real (solo lectura).
+        app.alarm_store = AlarmStore(os.path.join(tmp_dir, 'replay_alarms.db'))
+        app.zone_store = ZoneStore(app.ZONES_CONFIG_PATH, app.ZONES_MAX_PER_CAMERA)
+        app.clip_recorder = ClipRecorder(os.path.join(tmp_dir, 'clips'), app.CLIP_PRE_EVENT_SEC,
+                                         app.CLIP_POST_EVENT_SEC, app.CLIP_BUFFER_MAX_BYTES, app.CLIP_FALLBACK_FPS)
+        frames = 0
+        replay_started = time.perf_counter()
+        read_started = replay_started
+        for offset_sec, frame in iter_source_frames(source, fps):
+            recorder.observe(time.perf_counter() - read_started, stage='capture')
+            clock.advance_to(offset_sec)
+            frame_started = time.perf_counter()
+            app.process_frame(camera, frame, clock.time())
+            recorder.observe(time.perf_counter() - frame_started, stage='frame_total')
+            frames += 1
+            if max_frames and frames >= max_frames:
+                break
+            read_started = time.perf_counter()
+        elapsed = time.perf_counter() - replay_started
+        alarms = app.alarm_store.active()
+        app.drain_clip_encoder(camera)
+        app.clip_recorder.close()
+        app.alarm_store.close()
+
+    timeline = sorted(({'t': round((datetime.fromisoformat(alarm['timestamp_detected']) - start).total_seconds(), 3),
+                        'type': alarm['type'],
+                        'track_id': alarm['track_id']} for alarm in alarms),
+                      key=lambda event: (event['t'], event['type'], event['track_id'] or 0))
+    return {
+        'source': os.path.basename(os.path.normpath(source)),
+        'frames': frames,
+        'simulated_duration_sec': round(clock.offset_sec, 3),
+        'wall_time_sec': round(elapsed, 3),
+        'fps': round(frames / elapsed, 2) if elapsed > 0 else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': recorder.summary(),
+        'inference': dict(app.inference_pool.stats) if app.inference_pool else None,
+        'alarm_timeline': timeline,
+    }
+
+
+def compare_with_baseline(report, baseline, fps_tolerance=DEFAULT_FPS_TOLERANCE,
+                          latency_tolerance=DEFAULT_LATENCY_TOLERANCE, rss_tolerance=DEFAULT_RSS_TOLERANCE,
+                          timeline_tolerance_sec=DEFAULT_TIMELINE_TOLERANCE_SEC):
+    """Devuelve la lista de regresiones de rendimiento y de comportamiento respecto a la línea base."""
+    problems = []
+    if report['frames'] != baseline['frames']:
+        problems.append(f"Frames procesados: {report['frames']} (línea base {baseline['frames']})")
+    if report['fps'] < baseline['fps'] * (1 - fps_tolerance):
+        problems.append(f"FPS: {report['fps']} < {baseline['fps']} -{fps_tolerance:.0%}")
+    if report['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + rss_tolerance):
+        problems.append(f"Pico de RSS: {report['peak_rss_mb']} MB > {baseline['peak_rss_mb']} MB +{rss_tolerance:.0%}")
+    for stage, reference in baseline['stages'].items():
+        current = report['stages'].get(stage)
+        if current is None:
+            problems.append(f"Etapa '{stage}' ausente en el replay")
+        elif current['p99_ms'] > reference['p99_ms'] * (1 + latency_tolerance):
+            problems.append(f"p99 de '{stage}': {current['p99_ms']} ms > {reference['p99_ms']} ms +{latency_tolerance:.0%}")
+
+    expected = baseline['alarm_timeline']
+    actual = report['alarm_timeline']
+    if len(actual) != len(expected):
+        problems.append(f"Número de alarmas: {len(actual)} (línea base {len(expected)})")
+    for idx, (event, reference) in enumerate(zip(actual, expected)):
+        if event['type'] != reference['type'] or abs(event['t'] - reference['t']) > timeline_tolerance_sec:
+            problems.append(f"Alarma #{idx}: {event['type']} en t={event['t']}s "
+                            f"(línea base {reference['type']} en t={reference['t']}s)")
+            break
+    return problems
+
+
+def print_report(report):
+    print(f"\nReplay de '{report['source']}': {report['frames']} frames "
+          f"({report['simulated_duration_sec']:.1f}s simulados) en {report['wall_time_sec']:.1f}s")
+    print(f"FPS: {report['fps']:.1f}   Pico de RSS: {report['peak_rss_mb']:.0f} MB")
+    print(f"{'Etapa':<16}{'p50 ms':>10}{'p99 ms':>10}{'Muestras':>10}")
+    for stage, row in report['stages'].items():
+        print(f"{stage:<16}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['count']:>10}")
+    print("Alarmas:")
+    for event in report['alarm_timeline']:
+        track = f" (track #{event['track_id']})" if event['track_id'] is not None else ''
+        print(f"  t={event['t']:>8.2f}s  {event['type']}{track}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reproduce una grabación por el pipeline de detección sin servidor "
+                                                 "y mide rendimiento y alarmas.")
+    parser.add_argument('source', help="Vídeo grabado o directorio de frames")
+    parser.add_argument('--fps', type=float, help="FPS de la grabación (por defecto el del vídeo, o 25 para imágenes)")
+    parser.add_argument('--max-frames', type=int)
+    parser.add_argument('--start', default=DEFAULT_REPLAY_START,
+                        help="Fecha y hora simulada del primer frame (ISO 8601); afecta a la franja horaria de la luz")
+    parser.add_argument('--output', help="Guarda el informe JSON en esta ruta (p. ej. para crear la línea base)")
+    parser.add_argument('--baseline', help="Compara con un informe guardado y sale con código 1 si hay regresiones")
+    parser.add_argument('--fps-tolerance', type=float, default=DEFAULT_FPS_TOLERANCE)
+    parser.add_argument('--latency-tolerance', type=float, default=DEFAULT_LATENCY_TOLERANCE)
+    parser.add_argument('--rss-tolerance', type=float, default=DEFAULT_RSS_TOLERANCE)
+    parser.add_argument('--timeline-tolerance-sec', type=float, default=DEFAULT_TIMELINE_TOLERANCE_SEC)
+    args = parser.parse_args()
+
+    replay_report = run_replay(args.source, datetime.fromisoformat(args.start), args.fps, args.max_frames)
+    if app.inference_pool is not None:
+        app.inference_pool.shutdown()
+    print_report(replay_report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(replay_report, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f"Informe guardado en '{args.output}'.")
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline_report = json.load(f)
+        regressions = compare_with_baseline(replay_report, baseline_report, args.fps_tolerance,
+                                            args.latency_tolerance, args.rss_tolerance, args.timeline_tolerance_sec)
+        if regressions:
+            print(f"\nREGRESIONES respecto a '{args.baseline}':")
+            for problem in regressions:
+                print(f"  - {problem}")
+            sys.exit(1)
+        print(f"\nSin regresiones respecto a '{args.baseline}'.")
@@ -0,0 +1,144 @@
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.float32)
+    a = np.asarray(boxes_a, dtype=np.float32)[:, None, :4]
+    b = np.asarray(boxes_b, dtype=np.float32)[None, :, :4]
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+def center_distances(track_boxes, boxes):
+    """Distancia entre centros dividida por el lado mayor de cada caja de track (filas)."""
+    a = np.asarray(track_boxes, dtype=np.float32)[:, None, :4]
+    b = np.asarray(boxes, dtype=np.float32)[None, :, :4]
+    dx = (a[..., 0] + a[..., 2] - b[..., 0] - b[..., 2]) / 2
+    dy = (a[..., 1] + a[..., 3] - b[..., 1] - b[..., 3]) / 2
+    scale = np.maximum(np.maximum(a[..., 2] - a[..., 0], a[..., 3] - a[..., 1]), 1.0)
+    return np.hypot(dx, dy) / scale
+
+
+class Track:
+    """Caja seguida con un filtro de Kalman de velocidad constante sobre (cx, cy, w, h)."""
+
+    def __init__(self, track_id, box, confidence, now):
+        self.track_id = track_id
+        self.confidence = float(confidence)
+        self.hits = 1
+        self.misses = 0
+        self.last_predict_time = now
+        self.fallen_since = None
+        self.last_alarm_time = 0
+
+        x1, y1, x2, y2 = box[:4]
+        self._x = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, 0, 0, 0, 0], dtype=np.float64)
+        self._P = np.diag([10, 10, 10, 10, 1000, 1000, 1000, 1000]).astype(np.float64)
+        self._H = np.eye(4, 8)
+        self._R = np.diag([1, 1, 10, 10]).astype(np.float64)
+
+    @property
+    def box(self):
+        cx, cy, w, h = self._x[:4]
+        w = max(w, 1.0)
+        h = max(h, 1.0)
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self, now, confidence_decay):
+        dt = max(now - self.last_predict_time, 0.0)
+        self.last_predict_time = now
+        if dt == 0:
+            return
+        F = np.eye(8)
+        F[:4, 4:] = np.eye(4) * dt
+        Q = np.diag([1, 1, 1, 1, 10, 10, 10, 10]) * dt
+        self._x = F @ self._x
+        self._P = F @ self._P @ F.T + Q
+        self.confidence *= confidence_decay
+
+    def update(self, box, confidence):
+        x1, y1, x2, y2 = box[:4]
+        z = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+        S = self._H @ self._P @ self._H.T + self._R
+        K = self._P @ self._H.T @ np.linalg.inv(S)
+        self._x = self._x + K @ (z - self._H @ self._x)
+        self._P = (np.eye(8) - K @ self._H) @ self._P
+        self.confidence = float(confidence)
+        self.hits += 1
+        self.misses = 0
+
+
+class Tracker:
+    """Tracker tipo SORT: asociación voraz por IoU y predicción de Kalman entre detecciones.
+
+    Las detecciones que no alcanzan ``iou_threshold`` con ningún track se
+    intentan asociar después por distancia entre centros, relativa al lado
+    mayor de la caja predicha: cuando una persona cae, la caja pasa de
+    vertical a horizontal y el IoU baja aunque sea la misma persona, que
+    debe conservar su track (y su temporizador). Los tracks solo se eliminan
+    cuando el detector se ejecuta y no los encuentra ``max_misses`` veces
+    seguidas; entre detecciones solo baja su confianza.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=3, confidence_decay=0.85, center_gate=0.75):
+        self.iou_threshold = iou_threshold
+        self.center_gate = center_gate
+        self.max_misses = max_misses
+        self.confidence_decay = confidence_decay
+        self.tracks = []
+        self._next_id = 1
+
+    def predict(self, now):
+        for track in self.tracks:
+            track.predict(now, self.confidence_decay)
+        return self.tracks
+
+    def update(self, detections, now):
+        """``detections`` es un array (N, 5) con x1, y1, x2, y2, confianza."""
+        self.predict(now)
+        detections = np.asarray(detections, dtype=np.float32).reshape(-1, 5)
+        ious = iou_matrix([track.box for track in self.tracks], detections)
+
+        matched_tracks = set()
+        matched_detections = set()
+        if ious.size:
+            for flat_idx in np.argsort(-ious, axis=None):
+                track_idx, det_idx = np.unravel_index(flat_idx, ious.shape)
+                if ious[track_idx, det_idx] < self.iou_threshold:
+                    break
+                if track_idx in matched_tracks or det_idx in matched_detections:
+                    continue
+                self.tracks[track_idx].update(detections[det_idx], detections[det_idx, 4])
+                matched_tracks.add(track_idx)
+                matched_detections.add(det_idx)
+
+        if ious.size and len(matched_tracks) < len(self.tracks) and len(matched_detections) < len(detections):
+            distances = center_distances([track.box for track in self.tracks], detections)
+            for flat_idx in np.argsort(distances, axis=None):
+                track_idx, det_idx = np.unravel_index(flat_idx, distances.shape)
+                if distances[track_idx, det_idx] > self.center_gate:
+                    break
+                if track_idx in matched_tracks or det_idx in matched_detections:
+                    continue
+                self.tracks[track_idx].update(detections[det_idx], detections[det_idx, 4])
+                matched_tracks.add(track_idx)
+                matched_detections.add(det_idx)
+
+        for track_idx, track in enumerate(self.tracks):
+            if track_idx not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses < self.max_misses]
+
+        for det_idx in range(len(detections)):
+            if det_idx not in matched_detections:
+                self.tracks.append(Track(self._next_id, detections[det_idx], detections[det_idx, 4], now))
+                self._next_id += 1
+        return self.tracks
+
+    def needs_detection(self, min_confidence):
+        return any(track.confidence < min_confidence for track in self.tracks)
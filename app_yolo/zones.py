@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+
+ZONE_PAD_VALUE = 114
+
+
+def normalize_zones(zones, max_zones):
+    """Valida la lista de zonas recibida (p. ej. del dashboard) y la devuelve limpia; lanza ValueError si no es válida."""
+    if not isinstance(zones, list):
+        raise ValueError("Las zonas deben ser una lista.")
+    if len(zones) > max_zones:
+        raise ValueError(f"Como máximo {max_zones} zonas por cámara.")
+    normalized = []
+    for zone_idx, zone in enumerate(zones):
+        if not isinstance(zone, dict):
+            raise ValueError(f"Zona #{zone_idx + 1}: formato no válido.")
+        points = zone.get('points')
+        if not isinstance(points, list) or len(points) < 3:
+            raise ValueError(f"Zona #{zone_idx + 1}: hacen falta al menos 3 vértices.")
+        try:
+            points = [[min(max(float(x), 0.0), 1.0), min(max(float(y), 0.0), 1.0)] for x, y in points]
+        except (TypeError, ValueError):
+            raise ValueError(f"Zona #{zone_idx + 1}: los vértices deben ser pares [x, y] entre 0 y 1.")
+        normalized.append({
+            'name': str(zone.get('name') or f'Zona {zone_idx + 1}')[:40],
+            'points': points,
+            'fire': bool(zone.get('fire', True)),
+            'light': bool(zone.get('light', False)),
+        })
+    return normalized
+
+
+class ZoneStore:
+    """Zonas poligonales de cada cámara, guardadas en un fichero JSON de configuración.
+
+    Los vértices están normalizados (0-1) respecto al ancho y alto de la
+    imagen, así valen igual para el frame a resolución completa, para el
+    reescalado de proceso y para el dibujo del dashboard. ``version`` cambia
+    con cada modificación para que quien cachee derivados sepa recalcularlos.
+    """
+
+    def __init__(self, path, max_zones_per_camera):
+        self.path = path
+        self.max_zones_per_camera = max_zones_per_camera
+        self._lock = threading.Lock()
+        self._zones = {}
+        self.version = 0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    stored = json.load(f)
+                self._zones = {camera_id: normalize_zones(zones, max_zones_per_camera)
+                               for camera_id, zones in stored.items()}
+            except (OSError, ValueError, AttributeError) as e:
+                print(f"ADVERTENCIA: No se pudieron leer las zonas de '{path}': {e}. Se usará el frame completo.")
+                self._zones = {}
+
+    def get(self, camera_id):
+        # Las listas guardadas no se modifican nunca (set las sustituye), así que se pueden compartir.
+        with self._lock:
+            return self._zones.get(camera_id, [])
+
+    def set(self, camera_id, zones):
+        zones = normalize_zones(zones, self.max_zones_per_camera)
+        with self._lock:
+            updated = dict(self._zones)
+            if zones:
+                updated[camera_id] = zones
+            else:
+                updated.pop(camera_id, None)
+            tmp_path = self.path + '.part'
+            with open(tmp_path, 'w') as f:
+                json.dump(updated, f, indent=2, ensure_ascii=False)
+                f.write('\n')
+            os.replace(tmp_path, self.path)
+            self._zones = updated
+            self.version += 1
+        return zones
+
+
+def zone_polygon(zone, width, height):
+    return np.round(np.asarray(zone['points'], dtype=np.float32) * (width, height)).astype(np.int32)
+
+
+def zone_crops(frame, zones, crop_size):
+    """Recorta cada zona del frame y la encaja en un cuadrado de ``crop_size`` (los píxeles fuera del polígono se rellenan).
+
+    Devuelve (recortes, transformaciones); cada transformación es (x0, y0,
+    escala) y sirve para devolver las cajas del recorte al frame original.
+    Todos los recortes tienen el mismo tamaño para poder apilarlos en un lote.
+    """
+    height, width = frame.shape[:2]
+    crops = []
+    transforms = []
+    for zone in zones:
+        polygon = zone_polygon(zone, width, height)
+        x0, y0, box_w, box_h = cv2.boundingRect(polygon)
+        x1, y1 = min(x0 + box_w, width), min(y0 + box_h, height)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            continue
+        scale = min(crop_size / (x1 - x0), crop_size / (y1 - y0))
+        resized_w = min(crop_size, max(1, round((x1 - x0) * scale)))
+        resized_h = min(crop_size, max(1, round((y1 - y0) * scale)))
+        resized = cv2.resize(frame[y0:y1, x0:x1], (resized_w, resized_h),
+                             interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+        mask = np.zeros((resized_h, resized_w), dtype=np.uint8)
+        cv2.fillPoly(mask, [np.round((polygon - (x0, y0)) * scale).astype(np.int32)], 255)
+        # Como en el letterbox del preprocesado, el relleno va abajo y a la derecha: el origen no se desplaza.
+        crop = np.full((crop_size, crop_size, 3), ZONE_PAD_VALUE, dtype=np.uint8)
+        np.copyto(crop[:resized_h, :resized_w], resized, where=mask[:, :, None].astype(bool))
+        crops.append(crop)
+        transforms.append((x0, y0, scale))
+    return crops, transforms
+
+
+def crop_detections_to_frame(detections_per_crop, transforms, scale_x, scale_y):
+    """Une en un array (N, 6) las detecciones de los recortes, en coordenadas del frame original escalado por (scale_x, scale_y)."""
+    mapped = []
+    for detections, (x0, y0, scale) in zip(detections_per_crop, transforms):
+        if detections is None or not len(detections):
+            continue
+        boxes = detections.copy()
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] / scale + x0) * scale_x
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] / scale + y0) * scale_y
+        mapped.append(boxes)
+    return np.concatenate(mapped) if mapped else np.zeros((0, 6), dtype=np.float32)
+
+
+def zones_mask(zones, width, height):
+    """Máscara uint8 con la unión de los polígonos, o None si no hay zonas."""
+    if not zones:
+        return None
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, [zone_polygon(zone, width, height) for zone in zones], 255)
+    return mask
+
+
+def draw_zones(image, zones, color=(0, 165, 255)):
+    height, width = image.shape[:2]
+    for zone in zones:
+        polygon = zone_polygon(zone, width, height)
+        cv2.polylines(image, [polygon], True, color, 1)
+        cv2.putText(image, zone['name'], (int(polygon[:, 0].min()) + 3, int(polygon[:, 1].min()) + 14),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1)